@@ -0,0 +1,64 @@
+"""
+LemonDB Build Cache
+"""
+
+import functools
+import hashlib
+import os
+import shutil
+import subprocess
+
+CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'lemondb-test', 'build')
+SOURCE_EXTENSIONS = ('.c', '.cc', '.cpp', '.cxx', '.h', '.hh', '.hpp', '.hxx', '.inl', '.ipp', '.tpp', '.cmake')
+SOURCE_FILES = ('CMakeLists.txt',)
+FLAG_VARIABLES = ('CC', 'CXX', 'CFLAGS', 'CXXFLAGS', 'LDFLAGS')
+
+
+@functools.lru_cache(maxsize=None)
+def toolchain_version():
+    versions = []
+    for command in (os.environ.get('CXX', 'c++'), 'cmake'):
+        try:
+            versions.append(subprocess.run([command, '--version'], stdout=subprocess.PIPE,
+                                           stderr=subprocess.DEVNULL).stdout)
+        except OSError:
+            versions.append(b'')
+    return b'\0'.join(versions)
+
+
+def hash_project(project_dir, build_dir, flags):
+    """
+        Hash the sources of a project together with the compiler, cmake and build flags,
+        the build dir and hidden dirs like .git are skipped.
+    """
+    sha256 = hashlib.sha256()
+    sha256.update(toolchain_version())
+    sha256.update(repr(flags).encode('utf-8'))
+    for variable in FLAG_VARIABLES:
+        sha256.update(('%s=%s\0' % (variable, os.environ.get(variable, ''))).encode('utf-8'))
+    for root, dirs, files in os.walk(project_dir):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.') and
+                         os.path.join(root, d) != os.path.join(project_dir, build_dir))
+        for filename in sorted(files):
+            if filename in SOURCE_FILES or filename.endswith(SOURCE_EXTENSIONS):
+                path = os.path.join(root, filename)
+                sha256.update(os.path.relpath(path, project_dir).encode('utf-8') + b'\0')
+                with open(path, 'rb') as f:
+                    sha256.update(hashlib.sha256(f.read()).digest())
+    return sha256.hexdigest()
+
+
+def cached_program(key):
+    program = os.path.join(CACHE_DIR, key, 'lemondb')
+    if os.path.exists(program):
+        return program
+    return None
+
+
+def store_program(key, program):
+    cache_dir = os.path.join(CACHE_DIR, key)
+    os.makedirs(cache_dir, exist_ok=True)
+    temp_program = os.path.join(cache_dir, 'lemondb.%d' % os.getpid())
+    shutil.copy2(program, temp_program)
+    os.replace(temp_program, os.path.join(cache_dir, 'lemondb'))
+    return os.path.join(cache_dir, 'lemondb')
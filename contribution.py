@@ -0,0 +1,121 @@
+"""
+LemonDB Contribution Analyzer
+"""
+
+import concurrent.futures
+import hashlib
+import json
+import os
+import re
+import subprocess
+
+from logzero import logger
+
+from build_cache import CACHE_DIR
+
+BLAME_CACHE_DIR = os.path.join(os.path.dirname(CACHE_DIR), 'blame')
+# C/C++ sources and headers, the same files as the old gitfame --incl option
+INCLUDE_FILES = re.compile(r'.*\.[cht][ph]{0,2}$')
+SHORTLOG_LINE = re.compile(r'^\s*(\d+)\t(.*)$', re.M)
+
+
+def git(project_dir, *args):
+    return subprocess.run(['git', '-C', project_dir] + list(args), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                          check=True).stdout
+
+
+def list_files(project_dir, include_files=INCLUDE_FILES):
+    """
+        :return: dict of the files of HEAD in project_dir to their blob hashes
+    """
+    files = {}
+    for line in git(project_dir, 'ls-tree', '-r', '-z', 'HEAD').split(b'\0'):
+        if not line:
+            continue
+        info, filename = line.split(b'\t', 1)
+        mode, object_type, blob = info.split()
+        filename = filename.decode('utf-8', 'replace')
+        if object_type == b'blob' and include_files.search(filename):
+            files[filename] = blob.decode('ascii')
+    return files
+
+
+def blame_file(project_dir, filename):
+    """
+        :return: dict of author names to their surviving lines in the file, whitespace changes are ignored
+    """
+    lines = {}
+    output = git(project_dir, 'blame', '--line-porcelain', '-w', 'HEAD', '--', filename)
+    for line in output.split(b'\n'):
+        if line.startswith(b'author '):
+            author = line[7:].decode('utf-8', 'replace')
+            lines[author] = lines.get(author, 0) + 1
+    return lines
+
+
+def load_blame_cache(cache_path):
+    try:
+        with open(cache_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_blame_cache(cache_path, cache):
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    temp_path = '%s.%d' % (cache_path, os.getpid())
+    with open(temp_path, 'w') as f:
+        json.dump(cache, f)
+    os.replace(temp_path, cache_path)
+
+
+def get_contribution(project_dir, jobs=None):
+    """
+        Surviving lines, commits and files of every author, the same table as gitfame.
+        The blame of a file is cached by its path and blob hash, so only the files changed
+        since the last report are blamed again, in parallel.
+        :return: list of dicts with author, lines, lines%, commits, commits%, files and files%
+    """
+    project_dir = os.path.abspath(project_dir)
+    cache_path = os.path.join(BLAME_CACHE_DIR, hashlib.sha256(project_dir.encode('utf-8')).hexdigest()[:16] + '.json')
+    cache = load_blame_cache(cache_path)
+
+    files = list_files(project_dir)
+    keys = {filename: '%s:%s' % (filename, blob) for filename, blob in files.items()}
+    missing = [filename for filename in files.keys() if keys[filename] not in cache]
+    logger.info('Blame %d of %d files in %s', len(missing), len(files), project_dir)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as executor:
+        for filename, lines in zip(missing, executor.map(lambda x: blame_file(project_dir, x), missing)):
+            cache[keys[filename]] = lines
+    # only keep the blame of the files in HEAD
+    cache = {key: cache[key] for key in keys.values()}
+    save_blame_cache(cache_path, cache)
+
+    stats = {}
+
+    def author_stats(author):
+        return stats.setdefault(author, {'lines': 0, 'commits': 0, 'files': 0})
+
+    for key in keys.values():
+        for author, lines in cache[key].items():
+            author_stats(author)['lines'] += lines
+            author_stats(author)['files'] += 1
+    for commits, author in SHORTLOG_LINE.findall(git(project_dir, 'shortlog', '-s', 'HEAD').decode('utf-8', 'replace')):
+        author_stats(author)['commits'] += int(commits)
+
+    total_lines = max(1, sum(map(lambda x: x['lines'], stats.values())))
+    total_commits = max(1, sum(map(lambda x: x['commits'], stats.values())))
+    # like gitfame, a file blamed to several authors counts once for each of them
+    total_files = max(1, sum(map(lambda x: x['files'], stats.values())))
+    contribution = []
+    for author, s in sorted(stats.items(), key=lambda x: (-x[1]['commits'], -x[1]['lines'], x[0])):
+        contribution.append({
+            'author': author,
+            'lines': str(s['lines']),
+            'lines%': '%.1f' % (100 * s['lines'] / total_lines),
+            'commits': str(s['commits']),
+            'commits%': '%.1f' % (100 * s['commits'] / total_commits),
+            'files': str(s['files']),
+            'files%': '%.1f' % (100 * s['files'] / total_files),
+        })
+    return contribution
@@ -0,0 +1,266 @@
+"""
+LemonDB Grading Coordinator
+"""
+
+import http.server
+import json
+import os
+import threading
+import time
+
+import click
+from logzero import logger
+
+import test
+from result_store import ResultStore, RESULTS_DB
+
+PORT = 8482
+# a job is queued again when its worker sends no heartbeat for this long
+LEASE_TIME = 60.0
+# seconds a worker waits before asking again when no job fits its machine class
+RETRY_INTERVAL = 5.0
+
+
+class Coordinator:
+    """
+        Split the (project, query, iteration) matrix into jobs and lease them to workers.
+        Every query is pinned to the machine class of the first worker leasing one of its
+        jobs, so all times of a query are measured on the same hardware. The jobs of a worker
+        which stops sending heartbeats are queued again.
+    """
+
+    def __init__(self, project_dirs, queries, times, base_time, lease_time=LEASE_TIME, results_db=None):
+        self.queries = queries
+        self.times = times
+        self.lease_time = lease_time
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        self.pending = []
+        # job id -> (job, worker, deadline)
+        self.leases = {}
+        # query -> machine class
+        self.pinned = {}
+        # (project, query) -> {iteration: result}
+        self.results = {}
+        self.failed = set()
+        self.project_dirs = project_dirs
+        self.results_db = results_db
+        # project -> session id in the results db
+        self.sessions = {}
+        for project_dir in project_dirs:
+            for query in queries:
+                for iteration in range(1, times + 1):
+                    self.pending.append({
+                        'id': '%s:%s:%d' % (project_dir, query, iteration),
+                        'project': project_dir,
+                        'query': query,
+                        'iteration': iteration,
+                        'timeout': base_time[query],
+                    })
+        self.total = len(self.pending)
+
+    def __expire(self):
+        now = time.monotonic()
+        for job_id, (job, worker, deadline) in list(self.leases.items()):
+            if deadline < now:
+                del self.leases[job_id]
+                query = job['query']
+                if (job['project'], query) in self.failed:
+                    logger.warning('Lease of %s expired on %s', job_id, worker)
+                else:
+                    logger.warning('Lease of %s expired on %s, queued again', job_id, worker)
+                    self.pending.insert(0, job)
+                # a query without any time yet may still move to another machine class
+                if not any(map(lambda x: x[1] == query and self.results[x], self.results.keys())) and \
+                        not any(map(lambda x: x[0]['query'] == query, self.leases.values())):
+                    self.pinned.pop(query, None)
+        if not self.pending and not self.leases:
+            self.finished.set()
+
+    def expire(self):
+        with self.lock:
+            self.__expire()
+
+    def lease(self, worker, machine):
+        """
+            :return: {'job'} with the first pending job of a query pinned to the machine class or not
+                     pinned yet, {'wait'} if there is none, {'done'} when all jobs are finished
+        """
+        with self.lock:
+            self.__expire()
+            if not self.pending and not self.leases:
+                return {'done': True}
+            for i, job in enumerate(self.pending):
+                if self.pinned.setdefault(job['query'], machine) == machine:
+                    self.pending.pop(i)
+                    self.leases[job['id']] = (job, worker, time.monotonic() + self.lease_time)
+                    logger.info('Lease %s to %s', job['id'], worker)
+                    return {'job': job}
+            return {'wait': RETRY_INTERVAL}
+
+    def heartbeat(self, worker):
+        with self.lock:
+            deadline = time.monotonic() + self.lease_time
+            for job_id, (job, lease_worker, _) in self.leases.items():
+                if lease_worker == worker:
+                    self.leases[job_id] = (job, worker, deadline)
+        return {}
+
+    def add_result(self, worker, job_id, result, program, threads):
+        with self.lock:
+            lease = self.leases.pop(job_id, None)
+            if lease is None or lease[1] != worker:
+                # the lease expired and the job was given to another worker
+                logger.warning('Result of %s from %s ignored', job_id, worker)
+                return {}
+            job = lease[0]
+            key = (job['project'], job['query'])
+            self.results.setdefault(key, {})[job['iteration']] = tuple(result)
+            status, realtime, usage = result
+            logger.info('%s %s %2d on %s: %s %.3f s', job['project'], job['query'], job['iteration'], worker,
+                        status, realtime)
+            if self.results_db:
+                self.__store(job, program, threads, result)
+            if status != "AC" and key not in self.failed:
+                # like test(), a query is not run again after an error
+                self.failed.add(key)
+                self.pending = list(filter(lambda x: (x['project'], x['query']) != key, self.pending))
+            if not self.pending and not self.leases:
+                self.finished.set()
+        return {}
+
+    def __store(self, job, program, threads, result):
+        # every request has its own thread and a sqlite connection can not be shared between threads
+        store = ResultStore(self.results_db)
+        project_dir = job['project']
+        if project_dir not in self.sessions:
+            self.sessions[project_dir] = store.open_session(project_dir, {
+                'program': program,
+                'queries': self.queries,
+                'times': self.times,
+                'distributed': True,
+            })
+        store.session_id = self.sessions[project_dir]
+        store.add_run(job['query'], threads, job['iteration'], result)
+        store.close()
+
+    def status(self):
+        with self.lock:
+            return {
+                'total': self.total,
+                'pending': len(self.pending),
+                'leased': len(self.leases),
+                'pinned': dict(self.pinned),
+            }
+
+    def save(self):
+        """
+            Save time.csv, status.csv and usage.csv of every project, as test.py does.
+        """
+        for project_dir in self.project_dirs:
+            results = []
+            for query in self.queries:
+                runs = self.results.get((project_dir, query), {})
+                result = []
+                for iteration in sorted(runs.keys()):
+                    result.append(runs[iteration])
+                    if runs[iteration][0] != "AC":
+                        break
+                results.append(result)
+            columns = max([self.times] + list(map(len, results)))
+            test.save_result(results, columns, os.path.join(project_dir, 'time.csv'),
+                             os.path.join(project_dir, 'status.csv'), os.path.join(project_dir, 'usage.csv'))
+        if self.sessions:
+            store = ResultStore(self.results_db)
+            for session_id in self.sessions.values():
+                store.session_id = session_id
+                store.finish_session()
+            store.close()
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    def __reply(self, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/status':
+            self.__reply(self.server.coordinator.status())
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        coordinator = self.server.coordinator
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if self.path == '/lease':
+            self.__reply(coordinator.lease(request['worker'], request['machine']))
+        elif self.path == '/heartbeat':
+            self.__reply(coordinator.heartbeat(request['worker']))
+        elif self.path == '/result':
+            self.__reply(coordinator.add_result(request['worker'], request['job'], request['result'],
+                                                request.get('program'), request.get('threads', 0)))
+        else:
+            self.send_error(404)
+
+    def log_message(self, format, *args):
+        logger.debug('%s %s', self.address_string(), format % args)
+
+
+@click.command()
+@click.option('-p', '--project-dir', multiple=True, help='LemonDB Directory (can be given several times).')
+@click.option('--all', 'all_dir', help='Grade all git repos in this directory.')
+@click.option('-d', '--data-dir', default='.', help='Data Directory (contains answer/time.csv).')
+@click.option('-q', '--query', 'queries', multiple=True, help='Query to test instead of the default ones.')
+@click.option('--times', default=5, type=int)
+@click.option('--host', default='0.0.0.0', help='Address the coordinator listens on.')
+@click.option('--port', default=PORT, type=int)
+@click.option('--lease-time', default=LEASE_TIME, type=float,
+              help='Seconds without a heartbeat after which the jobs of a worker are queued again, '
+                   'longer than the heartbeat interval of the workers (10 s).')
+@click.option('--results-db', default=RESULTS_DB,
+              help='SQLite database every run is added to, an empty string disables it.')
+def main(project_dir, all_dir, data_dir, queries, times, host, port, lease_time, results_db):
+    from report import find_projects
+
+    project_dirs = list(map(os.path.abspath, project_dir))
+    if all_dir:
+        project_dirs += list(map(lambda x: os.path.abspath(x[0]), find_projects(all_dir)))
+    if not project_dirs:
+        logger.error('Error: either --all or --project-dir is required!')
+        exit(-1)
+    if queries:
+        test.TEST_QUERY[:] = list(map(lambda x: (x, 1), queries))
+
+    answer_time_path = os.path.join(data_dir, 'answer', 'time.csv')
+    if not os.path.exists(answer_time_path):
+        logger.error('Error: answer not found!')
+        exit(-1)
+    base_time = test.load_base_time(answer_time_path)
+    for query, unit_time in test.TEST_QUERY:
+        base_time.setdefault(query, unit_time)
+
+    coordinator = Coordinator(project_dirs, list(map(lambda x: x[0], test.TEST_QUERY)), times, base_time,
+                              lease_time, results_db)
+    server = http.server.ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.coordinator = coordinator
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    logger.info('Coordinator of %d jobs listening on %s:%d', coordinator.total, host, port)
+
+    while coordinator.total and not coordinator.finished.wait(RETRY_INTERVAL):
+        # also queue the jobs of lost workers again while no worker is asking
+        coordinator.expire()
+    coordinator.save()
+    # the last workers learn that all jobs are finished before the server stops
+    time.sleep(RETRY_INTERVAL * 2)
+    server.shutdown()
+    logger.info('All jobs finished')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""
+LemonDB Query Feeder
+"""
+
+import errno
+import mmap
+import os
+import threading
+
+
+def __send(out_fd, in_fd, offset, length):
+    try:
+        return os.sendfile(out_fd, in_fd, offset, length)
+    except OSError as e:
+        if e.errno not in (errno.EINVAL, errno.ENOSYS):
+            raise
+    with mmap.mmap(in_fd, 0, access=mmap.ACCESS_READ) as m:
+        with memoryview(m)[offset:offset + length] as view:
+            return os.write(out_fd, view)
+
+
+def send_range(out_fd, in_fd, offset, length):
+    """
+        Copy a byte range of a query file into a FIFO without reading it into the harness,
+        sendfile moves the pages from the page cache to the pipe inside the kernel.
+        Writing from a memory-mapped file is the fallback where sendfile can not write to a pipe.
+        :return: bytes copied before the FIFO would block
+    """
+    sent = 0
+    try:
+        while sent < length:
+            n = __send(out_fd, in_fd, offset + sent, length - sent)
+            if n == 0:
+                raise EOFError('query file truncated while feeding')
+            sent += n
+    except BlockingIOError:
+        pass
+    return sent
+
+
+class QueryFeeder:
+    """
+        Write the LISTEN segments of a query into the FIFOs of lemondb without blocking.
+        A file is fed until its last segment is written, then the feeder waits until
+        lemondb reports that it has run every query written so far.
+    """
+
+    def __init__(self, query_dir, base_query_file, query_files):
+        self.base_query_file = base_query_file
+        self.query_files = query_files
+        self.source_fds = {}
+        for query_file in query_files.keys():
+            self.source_fds[query_file] = os.open(os.path.join(query_dir, query_file), os.O_RDONLY)
+        self.line_max = sum(data_lines for segments in query_files.values() for data_lines, data in segments) - 1
+        self.line_expect = 0
+        self.line_now = 0
+        self.feeding = False
+        self.close_current = False
+        # [query file, fifo fd, index of the next segment]
+        self.stack = []
+        self.pending = None
+        self.opening = None
+        self.opened = None
+        self.open_thread = None
+        # the thread opening a FIFO wakes up the event loop through this pipe
+        self.wakeup_fd, self.__wakeup_write_fd = os.pipe()
+        os.set_blocking(self.wakeup_fd, False)
+
+    def __open_fifo(self, query_file):
+        # opening a FIFO blocks until lemondb opens it for reading, so it is done in a thread
+        fd = os.open(query_file, os.O_WRONLY)
+        os.set_blocking(fd, False)
+        self.opened = fd
+        os.write(self.__wakeup_write_fd, b'\0')
+
+    def __finish(self):
+        self.feeding = False
+        self.line_expect = min(self.line_max, self.line_now)
+
+    def start(self):
+        self.opening = self.base_query_file
+        self.feeding = True
+        return self.pump()
+
+    def wakeup(self):
+        try:
+            os.read(self.wakeup_fd, 4096)
+        except BlockingIOError:
+            pass
+        return self.pump()
+
+    def on_counter(self, counter):
+        if not self.feeding and counter >= self.line_expect and (counter < self.line_max or self.line_max == 0):
+            self.feeding = True
+            self.close_current = False
+            self.line_now = self.line_expect
+        return self.pump()
+
+    def pump(self):
+        """
+            :return: the FIFO fd to wait for when it is full, None otherwise
+        """
+        while self.feeding:
+            if self.pending:
+                fd, source_fd, offset, length = self.pending
+                sent = send_range(fd, source_fd, offset, length)
+                if sent < length:
+                    self.pending = (fd, source_fd, offset + sent, length - sent)
+                    return fd
+                self.pending = None
+                continue
+            if self.opening:
+                if self.opened is None:
+                    if self.open_thread is None:
+                        self.open_thread = threading.Thread(target=self.__open_fifo, args=(self.opening,),
+                                                            daemon=True)
+                        self.open_thread.start()
+                    return None
+                self.stack.append([self.opening, self.opened, 0])
+                self.opening = self.opened = self.open_thread = None
+                continue
+            if len(self.stack) == 0:
+                self.__finish()
+                break
+            query_file_now, fd, i = self.stack[-1]
+            segments = self.query_files[query_file_now]
+            if i == len(segments):
+                os.close(fd)
+                self.stack.pop()
+                continue
+            if self.close_current:
+                self.__finish()
+                break
+            data_lines, data = segments[i]
+            self.stack[-1][2] = i + 1
+            if data_lines > 0:
+                offset, length = data
+                self.pending = (fd, self.source_fds[query_file_now], offset, length)
+                self.line_now += data_lines
+                self.close_current = i + 1 == len(segments)
+            else:
+                self.opening = data
+        return None
+
+    def close(self):
+        for query_file_now, fd, i in self.stack:
+            os.close(fd)
+        self.stack = []
+        for fd in self.source_fds.values():
+            os.close(fd)
+        self.source_fds = {}
+        os.close(self.wakeup_fd)
+        os.close(self.__wakeup_write_fd)
@@ -1,82 +1,141 @@
+import json
+import mmap
 import os
+import random
 
+import click
+from logzero import logger
 
-def generate(query, listen_query, dest, levels):
-    files = 2 ** levels
-    with open(query) as f:
-        lines = f.readlines()
-    lines_per_file = len(lines) // files
-    for i in range(files * 2 - 1):
-        if i == 0:
-            filename = os.path.join(dest, listen_query)
-        else:
-            filename = os.path.join(dest, listen_query) + ".part" + str(i)
-        with open(filename, 'w') as f:
-            if i < files - 1:
-                f.write('LISTEN ( %s.part%d );\n' % (listen_query, (i + 1) * 2 - 1))
-                f.write('LISTEN ( %s.part%d );\n' % (listen_query, (i + 1) * 2))
-            else:
-                j = i - files + 1
-                if j == files - 1:
-                    f.writelines(lines[j * lines_per_file:])
-                else:
-                    f.writelines(lines[j * lines_per_file: (j + 1) * lines_per_file])
+CHUNK_SIZE = 1 << 20
 
+# shapes of the test_listen queries, 1 is a paragraph of queries and a list is a listened part file
+LISTEN_SHAPES = {
+    'test_listen_1': [[1]],
+    'test_listen_2': [[1], 1],
+    'test_listen_3': [1, [1], 1],
+    'test_listen_4': [[1], 1, [1], 1, [1]],
+    'test_listen_5': [[[1], [1]]],
+    'test_listen_6': [[[1], [1]], 1, [[1], [1]]],
+    'test_listen_7': [[[[1], [1]], [[1], [1]]], [[[1], [1]], [[1], [1]]]],
+    'test_listen_8': [1, [1, [1, [1, [1, [1, [1, [1]]]]]]]],
+}
 
-def generate2(query, listen_query, dest, split_list):
-    def get_count(_list):
-        p_count = 0
-        f_count = 1
-        for element in _list:
-            if isinstance(element, list):
-                a, b = get_count(element)
-                p_count += a
-                f_count += b
-            else:
-                p_count += 1
-        return p_count, f_count
 
-    paragraphs, files = get_count(split_list)
-    print(paragraphs, files)
+def balanced_shape(depth, fanout, inline):
+    """
+        :param depth: levels of listened files below the base query
+        :param fanout: listened files in every file above the last level
+        :param inline: paragraphs before every listened file and after the last one
+    """
+    if depth == 0:
+        return [1]
+    return ([1] * inline + [balanced_shape(depth - 1, fanout, inline)]) * fanout + [1] * inline
 
-    with open(query) as f:
-        lines = f.readlines()
-    lines_per_paragraph = len(lines) // paragraphs
 
-    def generate_file(_list, p_i=0, f_i=0):
-        print(p_i, f_i)
-        if f_i == 0:
-            filename = os.path.join(dest, listen_query)
+def random_shape(rng, depth, fanout, inline):
+    """
+        :param fanout: maximum listened files in every file, at least one
+        :param inline: probability of a paragraph before every listened file and after the last one
+    """
+    if depth == 0:
+        return [1]
+    shape = []
+    for i in range(rng.randint(1, fanout)):
+        if rng.random() < inline:
+            shape.append(1)
+        shape.append(random_shape(rng, depth - 1, fanout, inline))
+    if rng.random() < inline:
+        shape.append(1)
+    return shape
+
+
+def count_shape(shape):
+    """
+        :return: number of paragraphs, number of files
+    """
+    p_count = 0
+    f_count = 1
+    for element in shape:
+        if isinstance(element, list):
+            a, b = count_shape(element)
+            p_count += a
+            f_count += b
         else:
-            filename = os.path.join(dest, listen_query) + ".part" + str(f_i)
-        with open(filename, 'w') as f:
-            for element in _list:
-                if isinstance(element, list):
-                    f.write('LISTEN ( %s.part%d );\n' % (listen_query, f_i + 1))
-                    p_i, f_i = generate_file(element, p_i, f_i + 1)
-                else:
-                    if p_i == paragraphs - 1:
-                        f.writelines(lines[p_i * lines_per_paragraph:])
+            p_count += 1
+    return p_count, f_count
+
+
+def split(query, listen_query, dest, shape):
+    """
+        Stream the query file once into the files of a LISTEN tree. The file is cut into
+        paragraphs of about the same size at line ends, so that no query is broken.
+        :param shape: nested lists, 1 is a paragraph and a list is a listened part file
+    """
+    paragraphs, files = count_shape(shape)
+    logger.info('Split %s into %d paragraphs in %d files', query, paragraphs, files)
+
+    with open(query, 'rb') as source, mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        size = len(m)
+        bounds = [0]
+        for p_i in range(1, paragraphs):
+            bound = m.find(b'\n', max(bounds[-1], size * p_i // paragraphs - 1)) + 1
+            bounds.append(bound or size)
+        bounds.append(size)
+        if len(set(bounds)) < len(bounds):
+            logger.warning('%s has too few queries, some paragraphs are empty', query)
+
+        def generate_file(_list, p_i=0, f_i=0):
+            if f_i == 0:
+                filename = os.path.join(dest, listen_query)
+            else:
+                filename = os.path.join(dest, listen_query) + ".part" + str(f_i)
+            with open(filename, 'wb') as f:
+                for element in _list:
+                    if isinstance(element, list):
+                        f.write(b'LISTEN ( %s.part%d );\n' % (listen_query.encode('utf-8'), f_i + 1))
+                        p_i, f_i = generate_file(element, p_i, f_i + 1)
                     else:
-                        f.writelines(lines[p_i * lines_per_paragraph: (p_i + 1) * lines_per_paragraph])
-                    p_i += 1
-        return p_i, f_i
+                        for pos in range(bounds[p_i], bounds[p_i + 1], CHUNK_SIZE):
+                            f.write(m[pos:min(pos + CHUNK_SIZE, bounds[p_i + 1])])
+                        p_i += 1
+            return p_i, f_i
+
+        generate_file(shape)
+
+
+def generate(query, listen_query, dest, levels):
+    split(query, listen_query, dest, balanced_shape(levels, 2, 0))
+
+
+def generate2(query, listen_query, dest, split_list):
+    split(query, listen_query, dest, split_list)
+
 
-    generate_file(split_list)
+@click.command()
+@click.option('-s', '--source', default=os.path.join('query', 'test.query'), help='Query file to split.')
+@click.option('-n', '--name', help='Name of the listen query, all test_listen queries are generated if omitted.')
+@click.option('-o', '--output-dir', default='query', help='Directory of the generated files.')
+@click.option('--shape', help='Tree as nested json lists, such as [1,[1],1].')
+@click.option('--depth', default=1, type=int, help='Levels of listened files.')
+@click.option('--fanout', default=2, type=int, help='Listened files in every file (at most with --random).')
+@click.option('--inline', default=1, type=float,
+              help='Paragraphs around every listened file (their probability with --random).')
+@click.option('--random', 'random_tree', is_flag=True, help='Generate a random tree.')
+@click.option('--seed', default=0, type=int, help='Random seed of the tree.')
+def main(source, name, output_dir, shape, depth, fanout, inline, random_tree, seed):
+    if not name:
+        for listen_query, split_list in LISTEN_SHAPES.items():
+            split(source, listen_query + '.query', output_dir, split_list)
+        return
+    if shape:
+        shape = json.loads(shape)
+    elif random_tree:
+        shape = random_shape(random.Random(seed), depth, fanout, inline)
+    else:
+        shape = balanced_shape(depth, fanout, int(inline))
+    logger.info('Shape: %s', json.dumps(shape))
+    split(source, name + '.query', output_dir, shape)
 
 
 if __name__ == '__main__':
-    generate2('query/test.query', 'test_listen_1.query', 'query', [[1]])
-    generate2('query/test.query', 'test_listen_2.query', 'query', [[1], 1])
-    generate2('query/test.query', 'test_listen_3.query', 'query', [1, [1], 1])
-    generate2('query/test.query', 'test_listen_4.query', 'query', [[1], 1, [1], 1, [1]])
-    generate2('query/test.query', 'test_listen_5.query', 'query', [[[1], [1]]])
-    generate2('query/test.query', 'test_listen_6.query', 'query', [[[1], [1]], 1, [[1], [1]]])
-    generate2('query/test.query', 'test_listen_7.query', 'query', [[[[1], [1]], [[1], [1]]], [[[1], [1]], [[1], [1]]]])
-    generate2('query/test.query', 'test_listen_8.query', 'query', [1, [1, [1, [1, [1, [1, [1, [1]]]]]]]])
-
-    # generate('query/test.query', 'listen_test.query', 'query', 1)
-    # generate('query/single_read.query', 'listen_read.query', 'query', 3)
-    # generate('query/single_read_dup.query', 'listen_read_dup.query', 'query', 3)
-    # generate('query/single_read_update.query', 'listen_read_update.query', 'query', 3)
-    # generate('query/single_insert_delete.query', 'listen_insert_delete.query', 'query', 3)
+    main()
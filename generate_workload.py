@@ -0,0 +1,214 @@
+"""
+LemonDB Workload Generator
+"""
+
+import bisect
+import csv
+import itertools
+import os
+import random
+
+import click
+from logzero import logger
+
+QUERY_KINDS = ['read', 'update', 'insert', 'delete']
+READ_OPERATIONS = ['SELECT', 'SUM', 'COUNT', 'MIN', 'MAX']
+UPDATE_OPERATIONS = ['UPDATE', 'SWAP', 'ADD', 'SUB']
+VALUE_RANGE = 1000
+# recent reads a duplicated read is copied from
+DUP_WINDOW = 16
+
+
+class KeySampler:
+    """
+        Sample the live keys of a table, the popular keys are the oldest ones. Zipf weights
+        are computed once for the largest possible table and cut to the current size.
+    """
+
+    def __init__(self, rng, keys, max_keys, distribution, zipf_s):
+        self.rng = rng
+        self.keys = keys
+        self.cum_weights = None
+        if distribution == 'zipf':
+            self.cum_weights = list(itertools.accumulate(1 / (rank ** zipf_s) for rank in range(1, max_keys + 1)))
+
+    def index(self):
+        if self.cum_weights is None:
+            return self.rng.randrange(len(self.keys))
+        return bisect.bisect_right(self.cum_weights, self.rng.random() * self.cum_weights[len(self.keys) - 1])
+
+    def sample(self):
+        return self.keys[self.index()]
+
+    def pop(self):
+        return self.keys.pop(self.index())
+
+
+def generate_table(rng, table_name, rows, columns):
+    """
+        :return: lines of the table file and its keys
+    """
+    keys = ['k%d' % i for i in range(rows)]
+    lines = ['%s %d\n' % (table_name, columns + 1),
+             'KEY %s\n' % ' '.join(map(lambda x: 'c%d' % x, range(columns)))]
+    for key in keys:
+        lines.append('%s %s\n' % (key, ' '.join(map(str, (rng.randint(-VALUE_RANGE, VALUE_RANGE)
+                                                          for i in range(columns))))))
+    return lines, keys
+
+
+def generate_condition(rng, sampler, columns, key_ratio):
+    if sampler.keys and rng.random() < key_ratio:
+        return '( KEY = %s )' % sampler.sample()
+    return '( c%d %s %d )' % (rng.randrange(columns), rng.choice(['<', '>']), rng.randint(-VALUE_RANGE, VALUE_RANGE))
+
+
+def generate_query(rng, kind, table_name, sampler, columns, key_ratio, next_key):
+    if kind == 'insert' or (kind == 'delete' and not sampler.keys):
+        key = 'k%d' % next_key
+        sampler.keys.append(key)
+        return 'INSERT ( %s %s ) FROM %s;\n' % (
+            key, ' '.join(map(str, (rng.randint(-VALUE_RANGE, VALUE_RANGE) for i in range(columns)))), table_name)
+    if kind == 'delete':
+        # keys are deleted one by one, so that the sampler knows which keys are still alive
+        return 'DELETE ( ) FROM %s WHERE ( KEY = %s );\n' % (table_name, sampler.pop())
+    condition = generate_condition(rng, sampler, columns, key_ratio)
+    fields = rng.sample(range(columns), min(columns, 3))
+    if kind == 'read':
+        operation = rng.choice(READ_OPERATIONS)
+        if operation == 'SELECT':
+            operands = 'KEY ' + ' '.join(map(lambda x: 'c%d' % x, fields))
+        elif operation == 'COUNT':
+            operands = ''
+        else:
+            operands = ' '.join(map(lambda x: 'c%d' % x, fields))
+    else:
+        # SWAP needs two fields, ADD and SUB need two sources and a destination, one field only allows UPDATE
+        operation = rng.choice(UPDATE_OPERATIONS[:len(fields) > 1 and len(fields) + 1 or 1])
+        if operation == 'UPDATE':
+            operands = 'c%d %d' % (fields[0], rng.randint(-VALUE_RANGE, VALUE_RANGE))
+        else:
+            operands = ' '.join(map(lambda x: 'c%d' % x, fields[:operation == 'SWAP' and 2 or 3]))
+    return '%s ( %s ) FROM %s WHERE %s;\n' % (operation, operands, table_name, condition)
+
+
+def generate(data_dir, name, tables, rows, columns, queries, mix, distribution, zipf_s, key_ratio, dup, seed):
+    """
+        Write the tables into db/ and the query stream into query/, both named after the workload.
+        :return: name of the query file
+    """
+    rng = random.Random(seed)
+    db_dir = os.path.join(data_dir, 'db')
+    query_dir = os.path.join(data_dir, 'query')
+    os.makedirs(db_dir, exist_ok=True)
+    os.makedirs(query_dir, exist_ok=True)
+
+    table_names = ['%sTable%d' % (name, i) for i in range(tables)]
+    samplers = []
+    query_lines = []
+    for table_name in table_names:
+        lines, keys = generate_table(rng, table_name, rows, columns)
+        with open(os.path.join(db_dir, table_name + '.tbl'), 'w') as f:
+            f.writelines(lines)
+        samplers.append(KeySampler(rng, keys, rows + queries, distribution, zipf_s))
+        query_lines.append('LOAD ../db/%s.tbl;\n' % table_name)
+
+    kinds, weights = zip(*mix.items())
+    next_key = rows
+    recent_reads = []
+    for i in range(queries):
+        kind = rng.choices(kinds, weights)[0]
+        if kind == 'read' and recent_reads and rng.random() < dup:
+            query_lines.append(rng.choice(recent_reads))
+            continue
+        table = rng.randrange(tables)
+        line = generate_query(rng, kind, table_names[table], samplers[table], columns, key_ratio, next_key)
+        if kind == 'read':
+            recent_reads = (recent_reads + [line])[-DUP_WINDOW:]
+        elif line.startswith('INSERT'):
+            next_key += 1
+        query_lines.append(line)
+
+    for table_name in table_names:
+        query_lines.append('DUMP %s %s.tbl;\n' % (table_name, table_name))
+    query_lines.append('QUIT;\n')
+
+    query_file = name + '.query'
+    with open(os.path.join(query_dir, query_file), 'w') as f:
+        f.writelines(query_lines)
+    logger.info('Generated %d tables of %d rows and %d queries for %s', tables, rows, len(query_lines), name)
+    return query_file
+
+
+def merge_csv(path, query, row):
+    """
+        Replace the row of query in an answer csv, the other queries are kept.
+    """
+    rows = []
+    if os.path.exists(path):
+        with open(path) as f:
+            rows = list(csv.reader(f))[1:]
+    rows = [x for x in rows if x[0] != query] + [[query] + row]
+    columns = max(map(lambda x: len(x) - 1, rows))
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['query'] + list(map(lambda x: str(x + 1), range(columns))))
+        writer.writerows(rows)
+
+
+def answer_workload(data_dir, name, program, threads, times):
+    import test
+    temp_dir = test.init_tmpfs(data_dir)
+    results = test.test(program, name, data_dir, temp_dir, threads, times=times, generate_answer=True)
+    merge_csv(os.path.join(data_dir, 'answer', 'time.csv'), name, list(map(lambda x: str(x[1]), results)))
+    merge_csv(os.path.join(data_dir, 'answer', 'status.csv'), name, list(map(lambda x: x[0], results)))
+
+
+def parse_mix(ctx, param, value):
+    mix = {}
+    try:
+        for item in value.split(','):
+            kind, weight = item.split(':')
+            mix[kind.strip()] = float(weight)
+    except ValueError:
+        raise click.BadParameter('expected a list like read:60,update:20,insert:10,delete:10')
+    for kind in mix.keys():
+        if kind not in QUERY_KINDS:
+            raise click.BadParameter('unknown query kind %s, expected one of %s' % (kind, ', '.join(QUERY_KINDS)))
+    if sum(mix.values()) <= 0:
+        raise click.BadParameter('the weights can not all be zero')
+    return mix
+
+
+@click.command()
+@click.option('-n', '--name', required=True, help='Name of the workload, also the prefix of its tables.')
+@click.option('-d', '--data-dir', default='.', help='Data (with query, db and answer) Directory.')
+@click.option('--tables', default=1, type=int, help='Number of tables.')
+@click.option('--rows', default=1000, type=int, help='Rows of every table.')
+@click.option('--columns', default=4, type=int, help='Columns of every table besides KEY.')
+@click.option('--queries', default=10000, type=int, help='Number of queries besides LOAD, DUMP and QUIT.')
+@click.option('--mix', default='read:60,update:20,insert:10,delete:10', callback=parse_mix,
+              help='Weights of read, update, insert and delete queries.')
+@click.option('--distribution', default='uniform', type=click.Choice(['uniform', 'zipf']),
+              help='Distribution of the keys in conditions and deletes.')
+@click.option('--zipf-s', default=1.1, type=float, help='Exponent of the zipf distribution.')
+@click.option('--key-ratio', default=0.5, type=float, help='Ratio of conditions on KEY instead of a column range.')
+@click.option('--dup', default=0.0, type=float, help='Probability that a read repeats one of the recent reads.')
+@click.option('--seed', default=0, type=int, help='Random seed, the same options always generate the same files.')
+@click.option('--generate-answer', is_flag=True, help='Generate the answer with the reference program.')
+@click.option('-b', '--binary', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bin', 'lemondb'),
+              help='Reference program to generate the answer.')
+@click.option('--threads', default=1, type=int, help='Threads of the reference program.')
+@click.option('--times', default=1, type=int, help='Runs of the reference program, their time is the base time.')
+def main(name, data_dir, tables, rows, columns, queries, mix, distribution, zipf_s, key_ratio, dup, seed,
+         generate_answer, binary, threads, times):
+    if tables < 1 or columns < 1:
+        logger.error('Error: at least one table and one column are needed!')
+        exit(-1)
+    generate(data_dir, name, tables, rows, columns, queries, mix, distribution, zipf_s, key_ratio, dup, seed)
+    if generate_answer:
+        answer_workload(data_dir, name, os.path.abspath(binary), threads, times)
+
+
+if __name__ == '__main__':
+    main()
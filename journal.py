@@ -0,0 +1,75 @@
+"""
+LemonDB Result Journal
+"""
+
+import json
+import os
+
+from logzero import logger
+
+JOURNAL_NAME = 'journal.jsonl'
+
+
+class Journal:
+    """
+        Append-only record of every finished run, one json object per line. The first line
+        describes the session (program hash and settings), a resumed session must match it.
+    """
+
+    def __init__(self, path, session, resume=False):
+        """
+        :param path: journal file
+        :param session: dict identifying the program and settings of the session
+        :param resume: keep the results of a matching previous session
+        """
+        self.path = path
+        # compare with the loaded session in its json form, tuples become lists
+        self.session = json.loads(json.dumps(session))
+        self.results = {}
+        if resume and self.__load():
+            logger.info('Resume %s with %d finished runs', path, sum(map(len, self.results.values())))
+            self.file = open(path, 'a')
+        else:
+            self.file = open(path, 'w')
+            self.__write({'session': self.session})
+
+    def __load(self):
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, 'rb+') as f:
+            records = []
+            valid = 0
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break
+                if not line.endswith(b'\n'):
+                    records.pop()
+                    break
+                valid += len(line)
+            # the last line is torn if the harness was killed while writing it
+            f.truncate(valid)
+        if not records or records[0].get('session') != self.session:
+            logger.warning('Journal %s belongs to another program or settings, start over', self.path)
+            return False
+        for record in records[1:]:
+            key = (record['query'], record['threads'])
+            self.results.setdefault(key, []).append((record['status'], record['time'], record['usage']))
+        return True
+
+    def __write(self, record):
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def finished(self, query, threads):
+        return list(self.results.get((query, threads), []))
+
+    def append(self, query, threads, result):
+        status, realtime, usage = result
+        self.results.setdefault((query, threads), []).append(result)
+        self.__write({'query': query, 'threads': threads, 'status': status, 'time': realtime, 'usage': usage})
+
+    def close(self):
+        self.file.close()
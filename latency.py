@@ -0,0 +1,143 @@
+"""
+LemonDB Query Latency
+"""
+
+import math
+import os
+import re
+import time
+
+QUERY_TYPE = re.compile(rb'^\s*([A-Za-z]+)')
+PERCENTILES = [50, 90, 99]
+# upper bounds of the histogram buckets in seconds, the last bucket has no bound
+HISTOGRAM_BOUNDS = [1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1, 10]
+HISTOGRAM_NAMES = ['<10us', '<100us', '<1ms', '<10ms', '<100ms', '<1s', '<10s', '>=10s']
+# the percentiles are estimated from log buckets, 100 per decade are within 2.3% of the latency
+BUCKETS_PER_DECADE = 100
+MIN_LATENCY = 1e-9
+LATENCY_FIELDS = ['query', 'type', 'count', 'total', 'mean'] + \
+                 list(map(lambda x: 'p%d' % x, PERCENTILES)) + ['max'] + HISTOGRAM_NAMES
+
+
+def query_types(query_dir, base_query_file, query_files):
+    """
+        Types of the queries in the order lemondb counts them, the queries of a listened
+        file are run right after the LISTEN line of the file listening to it.
+        :return: list of query types, such as SELECT or LISTEN
+    """
+    types = []
+
+    def add_query_file(query_file):
+        with open(os.path.join(query_dir, query_file), 'rb') as f:
+            for data_lines, data in query_files[query_file]:
+                if data_lines == 0:
+                    add_query_file(data)
+                    continue
+                offset, length = data
+                f.seek(offset)
+                # split like count_lines, so that the types stay aligned with the counters
+                for line in f.read(length).split(b'\n')[:data_lines]:
+                    match = QUERY_TYPE.match(line)
+                    types.append(match.group(1).decode('utf-8').upper() if match else 'UNKNOWN')
+
+    add_query_file(base_query_file)
+    return types
+
+
+class LatencyTrace:
+    """
+        Timestamp every query counter printed by lemondb. The latency of a query is the time
+        between its counter and the previous one, counters read in the same chunk share the
+        time elapsed since the last chunk evenly. Only a summary of every query type is kept,
+        the run process sends it back through a pipe.
+    """
+
+    def __init__(self, types):
+        self.types = types
+        self.counter = 0
+        self.last = 0
+        self.latencies = {}
+
+    def start(self, start_ns):
+        self.last = start_ns
+
+    def on_counters(self, counters):
+        now = time.time_ns()
+        counters = [counter for counter in counters if counter > self.counter]
+        if not counters:
+            return
+        share = (now - self.last) / len(counters) / 1e9
+        for counter in counters:
+            query_type = self.types[counter - 1] if counter <= len(self.types) else 'UNKNOWN'
+            add_latency(self.latencies.setdefault(query_type, new_summary()), share)
+        self.counter = counters[-1]
+        self.last = now
+
+    def summary(self):
+        """
+            :return: dict of query type to a summary of its latencies, see merge_summary
+        """
+        return {query_type: dict(summary, buckets=sorted(summary['buckets'].items()))
+                for query_type, summary in self.latencies.items()}
+
+
+def new_summary():
+    return {'count': 0, 'total': 0, 'max': 0, 'histogram': [0] * len(HISTOGRAM_NAMES), 'buckets': {}}
+
+
+def histogram_index(latency):
+    i = 0
+    while i < len(HISTOGRAM_BOUNDS) and latency >= HISTOGRAM_BOUNDS[i]:
+        i += 1
+    return i
+
+
+def add_latency(summary, latency):
+    summary['count'] += 1
+    summary['total'] += latency
+    summary['max'] = max(summary['max'], latency)
+    summary['histogram'][histogram_index(latency)] += 1
+    bucket = math.floor(math.log10(max(latency, MIN_LATENCY)) * BUCKETS_PER_DECADE)
+    summary['buckets'][bucket] = summary['buckets'].get(bucket, 0) + 1
+
+
+def merge_summary(summary, other):
+    """
+        Add the summary of a run, its buckets are a list of [bucket, count], as they are in json.
+    """
+    summary['count'] += other['count']
+    summary['total'] += other['total']
+    summary['max'] = max(summary['max'], other['max'])
+    summary['histogram'] = list(map(sum, zip(summary['histogram'], other['histogram'])))
+    for bucket, count in other['buckets']:
+        summary['buckets'][bucket] = summary['buckets'].get(bucket, 0) + count
+
+
+def percentile(summary, p):
+    """
+        :param p: percentile in [0, 100], the geometric middle of the bucket of its rank
+    """
+    rank = (summary['count'] - 1) * p / 100
+    seen = 0
+    for bucket in sorted(summary['buckets'].keys()):
+        seen += summary['buckets'][bucket]
+        if seen > rank:
+            return min(10 ** ((bucket + 0.5) / BUCKETS_PER_DECADE), summary['max'])
+    return summary['max']
+
+
+def summarize_latency(query, latencies):
+    """
+        :param query: name of the query
+        :param latencies: dict of query type to the merged summary of all runs
+        :return: one row of LATENCY_FIELDS for every query type
+    """
+    rows = []
+    for query_type in sorted(latencies.keys()):
+        summary = latencies[query_type]
+        row = [query, query_type, summary['count'], summary['total'], summary['total'] / summary['count']]
+        row += list(map(lambda x: percentile(summary, x), PERCENTILES))
+        row.append(summary['max'])
+        rows.append(row + summary['histogram'])
+    return rows
+
@@ -0,0 +1,222 @@
+"""
+LemonDB Memory Limit
+"""
+
+import os
+import re
+import resource
+import time
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+# seconds between two samples of the RSS and the data size
+SAMPLE_INTERVAL = 0.05
+# a crash this close to the limit is a failed allocation, not a bug
+MLE_RATIO = 0.9
+# cgroup whose children have the memory controller, set by enable_memory_controller
+memory_cgroup = None
+# seconds to wait for the killed processes of a run to leave its cgroup
+REMOVE_TIMEOUT = 1.0
+SIZE_UNITS = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+
+def parse_size(value):
+    """
+        :param value: bytes with an optional binary unit, such as 512M or 8G
+    """
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*$', value, re.I)
+    if not match:
+        raise ValueError('invalid size: %s' % value)
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+
+def own_cgroup():
+    # the cgroup v2 of this process, such as /sys/fs/cgroup/user.slice/...
+    with open('/proc/self/cgroup') as f:
+        for line in f:
+            if line.startswith('0::'):
+                return os.path.join(CGROUP_ROOT, line[3:].strip().lstrip('/'))
+    return None
+
+
+def read_words(path):
+    with open(path) as f:
+        return f.read().split()
+
+
+def enable_memory_controller():
+    """
+        Move the harness into the leaf cgroup harness of its cgroup and enable the memory controller
+        for the children, because a cgroup with controllers for its children may not have processes
+        itself. Only possible when the cgroup of the harness is delegated to it, such as in
+        systemd-run --user --scope -p Delegate=yes, and has no other processes.
+        Call it before any run is started.
+        :return: whether a run can have its own cgroup
+    """
+    import psutil
+
+    global memory_cgroup
+    try:
+        parent = own_cgroup()
+        if not parent:
+            return False
+        if 'memory' not in read_words(os.path.join(parent, 'cgroup.subtree_control')):
+            if 'memory' not in read_words(os.path.join(parent, 'cgroup.controllers')):
+                return False
+            harness = {os.getpid()} | set(map(lambda x: x.pid, psutil.Process().children(recursive=True)))
+            procs = set(map(int, read_words(os.path.join(parent, 'cgroup.procs'))))
+            if not procs <= harness:
+                return False
+            leaf = os.path.join(parent, 'harness')
+            os.makedirs(leaf, exist_ok=True)
+            for pid in procs:
+                with open(os.path.join(leaf, 'cgroup.procs'), 'w') as f:
+                    f.write(str(pid))
+            with open(os.path.join(parent, 'cgroup.subtree_control'), 'w') as f:
+                f.write('+memory')
+    except (OSError, ValueError):
+        return False
+    memory_cgroup = parent
+    return True
+
+
+def create_cgroup(name, limit):
+    """
+        A cgroup with memory.max next to the leaf of the harness, see enable_memory_controller.
+        :return: path of the cgroup, None if it can not be created
+    """
+    if not memory_cgroup:
+        return None
+    try:
+        path = os.path.join(memory_cgroup, name)
+        os.mkdir(path)
+    except OSError:
+        return None
+    try:
+        with open(os.path.join(path, 'memory.max'), 'w') as f:
+            f.write(str(limit))
+        if os.path.exists(os.path.join(path, 'memory.swap.max')):
+            with open(os.path.join(path, 'memory.swap.max'), 'w') as f:
+                f.write('0')
+    except OSError:
+        os.rmdir(path)
+        return None
+    return path
+
+
+def cgroup_name(pid):
+    """
+        :param pid: pid of the run process
+    """
+    return 'lemondb-%d' % pid
+
+
+def remove_cgroup(name):
+    """
+        Remove the cgroup of a run from outside of the run process, which does not remove it when
+        it is killed at the timeout. A cgroup can only be removed once its processes exited.
+    """
+    if not memory_cgroup:
+        return
+    path = os.path.join(memory_cgroup, name)
+    deadline = time.monotonic() + REMOVE_TIMEOUT
+    while True:
+        try:
+            os.rmdir(path)
+            return
+        except FileNotFoundError:
+            return
+        except OSError:
+            if time.monotonic() >= deadline:
+                return
+            time.sleep(SAMPLE_INTERVAL)
+
+
+class MemoryLimitExceeded(Exception):
+    def __init__(self, peak):
+        super().__init__('peak RSS %d bytes' % peak)
+        self.peak = peak
+
+
+class MemoryLimit:
+    """
+        Cap the memory of one run of lemondb, with a cgroup when one can be created, otherwise
+        with RLIMIT_DATA, which counts the heap and the writable mappings but not the reserved
+        address space. The RSS of lemondb and its children is also sampled, so the run is ended
+        as soon as it exceeds the limit, even without a cgroup.
+        With a cgroup, a run is MLE when it was killed by the OOM killer of the cgroup. With
+        RLIMIT_DATA, a run is MLE when it crashed with its data size close to the limit, because
+        that is the size RLIMIT_DATA caps.
+    """
+
+    def __init__(self, limit, name):
+        self.limit = limit
+        self.peak = 0
+        self.peak_data = 0
+        self.process = None
+        self.last_sample = 0
+        self.cgroup = create_cgroup(name, limit)
+
+    def preexec(self):
+        # in the child, before lemondb is executed
+        if self.cgroup:
+            with open(os.path.join(self.cgroup, 'cgroup.procs'), 'w') as f:
+                f.write(str(os.getpid()))
+        else:
+            resource.setrlimit(resource.RLIMIT_DATA, (self.limit, self.limit))
+
+    def start(self, pid):
+        import psutil
+
+        try:
+            self.process = psutil.Process(pid)
+        except psutil.Error:
+            self.process = None
+
+    def check(self):
+        import psutil
+
+        now = time.monotonic()
+        if not self.process or now - self.last_sample < SAMPLE_INTERVAL:
+            return
+        self.last_sample = now
+        try:
+            info = self.process.memory_info()
+            rss = info.rss
+            for child in self.process.children(recursive=True):
+                rss += child.memory_info().rss
+        except psutil.Error:
+            # lemondb is exiting
+            return
+        self.peak = max(self.peak, rss)
+        self.peak_data = max(self.peak_data, info.data)
+        if rss > self.limit:
+            raise MemoryLimitExceeded(self.peak)
+
+    def exceeded(self, returncode, max_rss):
+        """
+            :param max_rss: peak RSS of lemondb itself
+            :return: whether a run which exited by itself was killed by the OOM killer of the cgroup
+                     or crashed with its data size close to RLIMIT_DATA
+        """
+        self.peak = max(self.peak, max_rss)
+        if self.cgroup:
+            try:
+                # memory.peak is only in Linux 5.19 and later
+                if os.path.exists(os.path.join(self.cgroup, 'memory.peak')):
+                    self.peak = max(self.peak, int(read_words(os.path.join(self.cgroup, 'memory.peak'))[0]))
+                with open(os.path.join(self.cgroup, 'memory.events')) as f:
+                    for line in f:
+                        key, value = line.split()
+                        if key == 'oom_kill' and int(value) > 0:
+                            return True
+            except (OSError, ValueError, IndexError):
+                pass
+            return False
+        return returncode != 0 and self.peak_data >= self.limit * MLE_RATIO
+
+    def close(self):
+        if self.cgroup:
+            try:
+                os.rmdir(self.cgroup)
+            except OSError:
+                pass
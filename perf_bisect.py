@@ -0,0 +1,147 @@
+"""
+LemonDB Performance Bisection
+"""
+
+import hashlib
+import math
+import os
+
+import click
+import git
+from logzero import logger
+
+import test
+from build_cache import CACHE_DIR
+from stats import summarize
+
+WORKTREE_DIR = os.path.join(os.path.dirname(CACHE_DIR), 'worktree')
+
+
+def open_worktree(repo):
+    """
+        A detached worktree of the repo kept in the cache, so that the build dir of the
+        previous commit is reused and the checkout of the team is never touched.
+    """
+    name = hashlib.sha256(os.path.abspath(repo.working_tree_dir).encode('utf-8')).hexdigest()[:16]
+    worktree_dir = os.path.join(WORKTREE_DIR, name)
+    if not os.path.exists(os.path.join(worktree_dir, '.git')):
+        repo.git.worktree('prune')
+        repo.git.worktree('add', '--detach', worktree_dir, 'HEAD')
+    return git.Repo(worktree_dir)
+
+
+class Bisector:
+    def __init__(self, repo, project_dir, query, data_dir, threads, times, max_times, confidence):
+        self.worktree = open_worktree(repo)
+        # the project may be a subdirectory of the repo
+        self.project_dir = os.path.join(self.worktree.working_tree_dir,
+                                        os.path.relpath(project_dir, repo.working_tree_dir))
+        self.query = query
+        # test() changes the working dir while it runs
+        self.data_dir = os.path.abspath(data_dir)
+        self.temp_dir = test.init_tmpfs(self.data_dir)
+        self.threads = threads
+        self.times = times
+        self.max_times = max_times
+        self.confidence = confidence
+        self.base_time = test.load_base_time(os.path.join(self.data_dir, 'answer', 'time.csv')).get(query, 1)
+        self.measured = {}
+
+    def build(self, commit):
+        self.worktree.git.checkout('--detach', '--force', commit.hexsha)
+        try:
+            return test.cached_build(self.project_dir, 'build', self.threads)
+        except SystemExit:
+            return None
+
+    def run(self, program, times, warmup=0):
+        return test.test(program, self.query, self.data_dir, self.temp_dir, self.threads, times=times,
+                         suggest_timeout=self.base_time, warmup=warmup)
+
+    def measure(self, commit, threshold=None):
+        """
+            Run the query until the confidence interval of the median is on one side of
+            the threshold, or max_times is reached.
+            :return: summary of the times, None if the commit can not be built or fails
+        """
+        program = self.build(commit)
+        if program is None:
+            logger.warning('%s: build failed, skipped', commit.hexsha[:10])
+            return None
+        results = []
+        while len(results) < self.max_times:
+            runs = self.run(program, min(self.times, self.max_times - len(results)), warmup=not results and 1 or 0)
+            results += runs
+            if any(map(lambda x: x[0] != "AC", runs)):
+                logger.warning('%s: %s, skipped', commit.hexsha[:10], runs[-1][0])
+                return None
+            summary = summarize(list(map(lambda x: x[1], results)), self.confidence, 'median')
+            if threshold is None or not summary['ci_low'] <= threshold <= summary['ci_high']:
+                break
+        logger.info('%s: median %.3f s, CI [%.3f, %.3f] over %d runs', commit.hexsha[:10], summary['median'],
+                    summary['ci_low'], summary['ci_high'], summary['n'])
+        self.measured[commit.hexsha] = summary
+        return summary
+
+    def bisect(self, good, bad, slowdown):
+        """
+            :return: the first commit on the first-parent path from good to bad slower than the
+                     geometric mean of the good and bad times, None if there is no such slowdown
+        """
+        good_summary = self.measure(good)
+        bad_summary = good_summary and self.measure(bad, good_summary['median'] * slowdown)
+        if good_summary is None or bad_summary is None:
+            logger.error('Error: good and bad commits must build and pass %s!', self.query)
+            return None
+        if bad_summary['median'] < good_summary['median'] * slowdown:
+            logger.error('Error: %s is not %.0f%% slower than %s on %s', bad.hexsha[:10], (slowdown - 1) * 100,
+                         good.hexsha[:10], self.query)
+            return None
+        threshold = math.sqrt(good_summary['median'] * bad_summary['median'])
+        logger.info('Threshold: %.3f s', threshold)
+
+        commits = list(reversed(list(self.worktree.iter_commits('%s..%s' % (good.hexsha, bad.hexsha),
+                                                                first_parent=True))))
+        # commits[lo] is the last known good (-1 for good itself), commits[hi] the first known bad
+        lo, hi = -1, len(commits) - 1
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            logger.info('Bisect: %d commits left, test %s', hi - lo - 1, commits[mid].hexsha[:10])
+            summary = self.measure(commits[mid], threshold)
+            if summary is None:
+                commits.pop(mid)
+                hi -= 1
+            elif summary['median'] >= threshold:
+                hi = mid
+            else:
+                lo = mid
+        return commits[hi]
+
+
+@click.command()
+@click.option('-p', '--project-dir', required=True, help='LemonDB Directory (a git repo).')
+@click.option('-q', '--query', required=True, help='Query which became slower.')
+@click.option('-g', '--good', required=True, help='A fast commit.')
+@click.option('-b', '--bad', default='HEAD', help='A slow commit.')
+@click.option('-d', '--data-dir', default='.', help='Data Directory (contains sample and db).')
+@click.option('--slowdown', default=1.1, type=float, help='Minimum ratio of the bad time to the good time.')
+@click.option('--threads', default=0, type=int, help='Threads of lemondb, default to the number of cores.')
+@click.option('--times', default=3, type=int, help='Runs of every commit between two checks of the interval.')
+@click.option('--max-times', default=15, type=int, help='Maximum runs of every commit.')
+@click.option('--confidence', default=0.95, type=float, help='Confidence level of the interval of the median.')
+def main(project_dir, query, good, bad, data_dir, slowdown, threads, times, max_times, confidence):
+    project_dir = os.path.abspath(project_dir)
+    repo = git.Repo(project_dir, search_parent_directories=True)
+    if threads == 0:
+        threads = int(test.get_platform()['threads'])
+    bisector = Bisector(repo, project_dir, query, data_dir, threads, times, max_times, confidence)
+    commit = bisector.bisect(repo.commit(good), repo.commit(bad), slowdown)
+    if commit is None:
+        exit(-1)
+    logger.info('First slow commit: %s %s', commit.hexsha, commit.summary)
+    for hexsha, summary in bisector.measured.items():
+        logger.info('%s %.3f s (%d runs)', hexsha[:10], summary['median'], summary['n'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+LemonDB Platform Probe
+"""
+
+import hashlib
+import json
+import os
+import platform
+
+from build_cache import CACHE_DIR
+
+PLATFORM_CACHE = os.path.join(os.path.dirname(CACHE_DIR), 'platform.json')
+CPU_MODEL_PREFIXES = (b'model name', b'Model', b'cpu model', b'Processor')
+
+
+def hardware_key():
+    """
+        Hash of the kernel, the CPU models and count and the memory size, the cached
+        probe is redone when any of them changes.
+    """
+    uname = platform.uname()
+    sha256 = hashlib.sha256()
+    for value in [uname.system, uname.release, uname.version, uname.machine, os.cpu_count()]:
+        sha256.update(('%s\0' % value).encode('utf-8'))
+    try:
+        sha256.update(('%d\0' % os.sysconf('SC_PHYS_PAGES')).encode('utf-8'))
+    except (ValueError, OSError, AttributeError):
+        pass
+    try:
+        with open('/proc/cpuinfo', 'rb') as f:
+            for line in sorted(set(filter(lambda x: x.startswith(CPU_MODEL_PREFIXES), f))):
+                sha256.update(line)
+    except OSError:
+        pass
+    return sha256.hexdigest()
+
+
+def probe_platform():
+    import cpuinfo
+    import humanize
+    import psutil
+
+    cpu_info = cpuinfo.get_cpu_info()
+    memory_info = psutil.virtual_memory()
+    brand = ''
+    if 'brand_raw' in cpu_info:
+        brand = cpu_info['brand_raw']
+    elif 'brand' in cpu_info:
+        brand = cpu_info['brand']
+    return {
+        'platform': platform.platform(),
+        'cpu': brand,
+        'threads': cpu_info['count'],
+        'memory': humanize.naturalsize(memory_info.total, gnu=True)
+    }
+
+
+def get_platform():
+    """
+        cpuinfo takes up to seconds, so its result is cached until the hardware key changes.
+    """
+    key = hardware_key()
+    try:
+        with open(PLATFORM_CACHE) as f:
+            cached = json.load(f)
+        if cached['key'] == key:
+            return cached['platform']
+    except (OSError, ValueError, KeyError):
+        pass
+    platform_info = probe_platform()
+    os.makedirs(os.path.dirname(PLATFORM_CACHE), exist_ok=True)
+    temp_path = '%s.%d' % (PLATFORM_CACHE, os.getpid())
+    with open(temp_path, 'w') as f:
+        json.dump({'key': key, 'platform': platform_info}, f)
+    os.replace(temp_path, PLATFORM_CACHE)
+    return platform_info
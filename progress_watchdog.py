@@ -0,0 +1,107 @@
+"""
+LemonDB Progress Watchdog
+"""
+
+import bisect
+import time
+
+WATCHDOG_MARGIN = 1.5
+# seconds between two checks when lemondb prints nothing
+CHECK_INTERVAL = 0.5
+# part of the timeout before the first check, the first counters are too few to project from
+GRACE = 0.3
+# part of the timeout over which the rate of progress is measured, also the shortest stall ending a run
+RATE_WINDOW = 0.05
+CURVE_POINTS = 200
+
+
+class HopelessRun(Exception):
+    def __init__(self, elapsed, projected):
+        super().__init__('projected %.3f s after %.3f s' % (projected, elapsed))
+        self.elapsed = elapsed
+        self.projected = projected
+
+
+class ProgressWatchdog:
+    """
+        Record the query counter of lemondb over time. With the progress curve of the baseline,
+        the work done is the part of the baseline time needed to reach the counter. The finish of
+        the run is projected from the rest of the work at the best rate seen in any window since
+        the first counter, so a slow start (loading, a slow first query) does not count against
+        the rest of the run, and the run is ended when the projection exceeds the timeout by the
+        margin. A counter frozen for longer than the baseline needed there, with the margin, is
+        no progress at all and projects to infinity, so a stalled run is ended too.
+    """
+
+    def __init__(self, baseline=None, timeout=None, margin=WATCHDOG_MARGIN):
+        """
+        :param baseline: list of [seconds, counter] of the baseline run
+        """
+        self.samples = [(0.0, 0)]
+        self.start_time = None
+        self.timeout = timeout
+        self.margin = margin
+        self.baseline_times = []
+        self.baseline_counters = []
+        # seconds and work done at the start of the current rate window, from the first counter on
+        self.window = None
+        self.best_rate = 0
+        if baseline and timeout and margin and baseline[-1][0] > 0:
+            self.baseline_times = list(map(lambda x: x[0], baseline))
+            self.baseline_counters = list(map(lambda x: x[1], baseline))
+
+    def start(self):
+        self.start_time = time.monotonic()
+
+    def on_counter(self, counter):
+        self.samples.append((time.monotonic() - self.start_time, counter))
+
+    def fraction(self, counter):
+        """
+            :return: part of the baseline time before the counter was printed
+        """
+        i = bisect.bisect_left(self.baseline_counters, counter)
+        if i >= len(self.baseline_counters):
+            return 1.0
+        return self.baseline_times[i] / self.baseline_times[-1]
+
+    def step(self, counter):
+        """
+            :return: part of the baseline time spent on the part of the curve the counter is in
+        """
+        i = min(bisect.bisect_right(self.baseline_counters, counter), len(self.baseline_counters) - 1)
+        return (self.baseline_times[i] - self.baseline_times[i - 1]) / self.baseline_times[-1]
+
+    def check(self):
+        # before the first counter (loading, a late start) only the timeout ends the run
+        if not self.baseline_counters or len(self.samples) < 2:
+            return
+        elapsed = time.monotonic() - self.start_time
+        last_time, counter = self.samples[-1]
+        done = self.fraction(counter)
+        if self.window is None:
+            self.window = (self.samples[1][0], self.fraction(self.samples[1][1]))
+        window_start, window_done = self.window
+        if elapsed - window_start >= self.timeout * RATE_WINDOW:
+            self.best_rate = max(self.best_rate, (done - window_done) / (elapsed - window_start))
+            self.window = (elapsed, done)
+        if elapsed < self.timeout * GRACE:
+            return
+        if elapsed - last_time > self.timeout * max(RATE_WINDOW, self.step(counter) * self.margin):
+            raise HopelessRun(elapsed, float('inf'))
+        # no rate window since the first counter yet
+        if self.best_rate <= 0:
+            return
+        projected = elapsed + (1 - done) / self.best_rate
+        if projected > self.timeout * self.margin:
+            raise HopelessRun(elapsed, projected)
+
+    def curve(self, points=CURVE_POINTS):
+        """
+            :return: at most points [seconds, counter] evenly taken from the samples, with the last one
+        """
+        step = max(1, len(self.samples) // points)
+        samples = self.samples[::step]
+        if samples[-1] != self.samples[-1]:
+            samples.append(self.samples[-1])
+        return list(map(lambda x: [round(x[0], 4), x[1]], samples))
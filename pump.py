@@ -0,0 +1,104 @@
+"""
+LemonDB Output Pump
+"""
+
+import os
+import re
+import selectors
+
+from memory_limit import SAMPLE_INTERVAL
+from progress_watchdog import CHECK_INTERVAL
+from usage import PEAK_INTERVAL
+
+COUNTER_LINE = re.compile(rb'^(\d+)$', re.M)
+CHUNK_SIZE = 1 << 16
+STDERR_TAIL = 4096
+
+
+def pump(p, feeder, stdout_file, trace=None, watchdog=None, checker=None, memory=None, peak=None):
+    """
+        Multiplex stdout and stderr of lemondb and the FIFO writers of the feeder in one event loop.
+        stdout is copied into stdout_file in large binary chunks and only the last query counter
+        of every chunk is parsed, because the counters are increasing.
+        :param trace: LatencyTrace timestamping all counters of every chunk
+        :param watchdog: ProgressWatchdog, checked at least every CHECK_INTERVAL seconds
+        :param checker: StdoutChecker, fed with every chunk of stdout
+        :param memory: MemoryLimit, its RSS is sampled every SAMPLE_INTERVAL seconds
+        :param peak: PeakRss, sampled every PEAK_INTERVAL seconds and when stdout is closed
+        :return: the tail of stderr
+    """
+    selector = selectors.DefaultSelector()
+    selector.register(p.stdout.fileno(), selectors.EVENT_READ, 'stdout')
+    selector.register(p.stderr.fileno(), selectors.EVENT_READ, 'stderr')
+    selector.register(feeder.wakeup_fd, selectors.EVENT_READ, 'wakeup')
+    write_fd = None
+    streams = 2
+    tail = b''
+    stderr = b''
+
+    def watch(feed):
+        nonlocal write_fd
+        try:
+            fd = feed()
+        except BrokenPipeError:
+            # lemondb closed a FIFO early, it is going to exit by itself
+            feeder.feeding = False
+            fd = None
+        if fd == write_fd:
+            return
+        if write_fd is not None:
+            selector.unregister(write_fd)
+        if fd is not None:
+            selector.register(fd, selectors.EVENT_WRITE, 'fifo')
+        write_fd = fd
+
+    timeout = peak and PEAK_INTERVAL or memory and SAMPLE_INTERVAL or watchdog and CHECK_INTERVAL or None
+    watch(feeder.start)
+    try:
+        while streams > 0:
+            for key, events in selector.select(timeout):
+                if key.data == 'stdout':
+                    chunk = os.read(key.fd, CHUNK_SIZE)
+                    if not chunk:
+                        # lemondb is exiting, the last chance to see its peak
+                        if peak:
+                            peak.sample(force=True)
+                        selector.unregister(key.fd)
+                        streams -= 1
+                        continue
+                    stdout_file.write(chunk)
+                    if checker:
+                        checker.feed(chunk)
+                    lines_end = chunk.rfind(b'\n') + 1
+                    if lines_end == 0:
+                        tail += chunk
+                        continue
+                    counters = COUNTER_LINE.findall(tail + chunk[:lines_end])
+                    tail = chunk[lines_end:]
+                    if counters:
+                        if trace:
+                            trace.on_counters(list(map(int, counters)))
+                        counter = int(counters[-1])
+                        if watchdog:
+                            watchdog.on_counter(counter)
+                        watch(lambda: feeder.on_counter(counter))
+                elif key.data == 'stderr':
+                    chunk = os.read(key.fd, CHUNK_SIZE)
+                    if not chunk:
+                        selector.unregister(key.fd)
+                        streams -= 1
+                        continue
+                    stderr = (stderr + chunk)[-STDERR_TAIL:]
+                elif key.data == 'wakeup':
+                    watch(feeder.wakeup)
+                else:
+                    watch(feeder.pump)
+            if watchdog:
+                watchdog.check()
+            if peak:
+                peak.sample()
+            if memory:
+                memory.check()
+    finally:
+        selector.close()
+    return stderr
@@ -0,0 +1,123 @@
+"""
+LemonDB Query Index
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import re
+
+from logzero import logger
+
+LISTEN_LINE = re.compile(rb'^LISTEN[^\n]*', re.M)
+CHUNK_SIZE = 1 << 20
+INDEX_SUFFIX = '.idx'
+INDEX_VERSION = 1
+
+
+# count lines in [start, end) like readlines() does, an unterminated last line also counts
+def count_lines(m, start, end):
+    lines = 0
+    for pos in range(start, end, CHUNK_SIZE):
+        lines += m[pos:min(pos + CHUNK_SIZE, end)].count(b'\n')
+    if end > start and m[end - 1] != ord('\n'):
+        lines += 1
+    return lines
+
+
+def index_query_file(path):
+    """
+        :param path: path of a query file
+        :return: segments split after every LISTEN line, (lines, (offset, length)) for
+                 queries and (0, filename) for the file listened by the previous segment
+    """
+    segments = []
+    if os.path.getsize(path) == 0:
+        return segments
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        size = len(m)
+        start = 0
+        for match in LISTEN_LINE.finditer(m):
+            end = min(match.end() + 1, size)
+            segments.append((count_lines(m, start, end), (start, end - start)))
+            result = re.findall(r"\(.+\)", match.group().decode('utf-8'))
+            if result:
+                segments.append((0, result[0].strip('( )')))
+            start = end
+        if start < size:
+            segments.append((count_lines(m, start, size), (start, size - start)))
+    return segments
+
+
+def hash_file(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+# json stores the (offset, length) ranges as lists
+def __load_segments(segments):
+    return [(data_lines, tuple(data) if data_lines else data) for data_lines, data in segments]
+
+
+def load_index(path):
+    """
+        Load the segments of a query file from its sidecar index, the query file is only
+        scanned again when its size, mtime and hash do not match the index any more.
+    """
+    index_path = path + INDEX_SUFFIX
+    stat = os.stat(path)
+    index = None
+    try:
+        with open(index_path) as f:
+            index = json.load(f)
+        if index['version'] != INDEX_VERSION or index['size'] != stat.st_size:
+            index = None
+        elif index['mtime'] == stat.st_mtime_ns:
+            return __load_segments(index['segments'])
+    except (OSError, ValueError, KeyError):
+        index = None
+
+    sha256 = hash_file(path)
+    if index and index['sha256'] == sha256:
+        # touched but not changed, only the mtime has to be updated
+        segments = __load_segments(index['segments'])
+    else:
+        logger.info('Index %s', path)
+        segments = index_query_file(path)
+
+    index = {
+        'version': INDEX_VERSION,
+        'size': stat.st_size,
+        'mtime': stat.st_mtime_ns,
+        'sha256': sha256,
+        'lines': sum(data_lines for data_lines, data in segments),
+        'listen': [data for data_lines, data in segments if data_lines == 0],
+        'segments': segments,
+    }
+    try:
+        with open(index_path + '.tmp', 'w') as f:
+            json.dump(index, f)
+        os.replace(index_path + '.tmp', index_path)
+    except OSError as e:
+        logger.warning('Can not save index %s: %s', index_path, e)
+    return segments
+
+
+def read_query(query_dir, query, use_index=True):
+    query_files = {}
+
+    def add_query_file(filename):
+        if filename in query_files:
+            return
+        path = os.path.join(query_dir, filename)
+        query_files[filename] = load_index(path) if use_index else index_query_file(path)
+        for data_lines, data in query_files[filename]:
+            if data_lines == 0:
+                add_query_file(data)
+
+    add_query_file(query)
+    return query_files
@@ -1,4 +1,5 @@
 import csv
+import concurrent.futures
 import os
 import tempfile
 import shutil
@@ -10,11 +11,13 @@ import re
 import json
 
 import click
-import jinja2
-from test import get_platform, calculate_average_time
-import git
-import gitfame
-import chardet
+from test import calculate_average_time
+from probe import get_platform
+from latency import HISTOGRAM_NAMES
+from usage import USAGE_FIELDS
+from result_store import ResultStore, RESULTS_DB
+from contribution import get_contribution
+from logzero import logger
 
 CORRECTNESS_QUERY = [
     ('test_quit', 2),
@@ -77,19 +80,27 @@ def tex_escape(text):
     return regex.sub(lambda match: conv[match.group()], text)
 
 
-def generate_result_times(data, data_length, remove_min_max=False):
-    output = ''
+def min_max_index(time_data):
+    """
+        :return: indices of the slowest and the fastest run, omitted from the performance average
+    """
     max_value = -1
     min_value = 1e9
     max_index = 0
     min_index = 0
-    for i in range(len(data['time_data'])):
-        if data['time_data'][i] > max_value:
-            max_value = data['time_data'][i]
+    for i in range(len(time_data)):
+        if time_data[i] > max_value:
+            max_value = time_data[i]
             max_index = i
-        if data['time_data'][i] < min_value:
-            min_value = data['time_data'][i]
+        if time_data[i] < min_value:
+            min_value = time_data[i]
             min_index = i
+    return max_index, min_index
+
+
+def generate_result_times(data, data_length, remove_min_max=False):
+    output = ''
+    max_index, min_index = min_max_index(data['time_data'])
 
     for i in range(data_length):
         if len(data['time_data']) > i:
@@ -107,17 +118,17 @@ def generate_result_times(data, data_length, remove_min_max=False):
     return output
 
 
-def generate_correctness_table(data, data_length):
-    output = '\\begin{tabular}{r|%s|cc}\n' % ('c' * data_length)
-    output += 'Test Case & \\multicolumn{%d}{c|}{Time (second)} & Score & Out of  \\\\\\hline' % data_length
-    total_score = 0
+def score_correctness(data):
+    """
+        :return: score of every correctness case, the listen cases share one score by the number accepted
+    """
+    rows = []
     for query, score in CORRECTNESS_QUERY:
-        result = data[query]
-        result_times = generate_result_times(result, data_length)
-        result_score = result['overall_status'] == 'AC' and score or 0
-        total_score += result_score
-        output += '\n%s & %s & %s & %s \\\\' % (query[5:], result_times, result_score, score)
-    output += '\\hline'
+        rows.append({
+            'query': query,
+            'score': data[query]['overall_status'] == 'AC' and score or 0,
+            'out_of': score,
+        })
     listen_ac = 0
     for query, score in LISTEN_QUERY:
         if data[query]['overall_status'] == 'AC':
@@ -126,71 +137,154 @@ def generate_correctness_table(data, data_length):
     for num, score in LISTEN_SCORE:
         if listen_ac >= num:
             listen_score += score
-    total_score += listen_score
+    return {
+        'rows': rows,
+        'listen': list(map(lambda x: x[0], LISTEN_QUERY)),
+        'listen_score': listen_score,
+        'listen_out_of': 10,
+        'score': sum(map(lambda x: x['score'], rows)) + listen_score,
+        'out_of': 30,
+    }
+
+
+def score_performance(data, base_data):
+    """
+        :return: log ratio to the base time and score of every performance case, the total score
+                 grows with the mean log ratio and shrinks with its standard deviation
+    """
+    log_ratios = []
+    for query, score in PERFORMANCE_QUERY:
+        result = data[query]
+        log_ratio = 0
+        if result['overall_status'] == 'AC':
+            log_ratio = max(0.0, math.log2(base_data[query]['average_time'] / result['average_time']))
+        log_ratios.append(log_ratio)
+    log_ratio_stddev = statistics.stdev(log_ratios)
+    log_ratio_sum = sum(log_ratios)
+    total_score = 60 * max(0.0, log_ratio_sum / len(log_ratios)) / (0.6 + 0.2 * log_ratio_stddev)
+
+    rows = []
+    for i, (query, score) in enumerate(PERFORMANCE_QUERY):
+        result = data[query]
+        rows.append({
+            'query': query,
+            'average_time': result['average_time'] if result['overall_status'] == 'AC' else None,
+            'base_time': base_data[query]['average_time'],
+            'log_ratio': log_ratios[i],
+            'score': log_ratio_sum and total_score * log_ratios[i] / log_ratio_sum,
+            'omitted': result['overall_status'] == 'AC' and sorted(set(min_max_index(result['time_data']))) or [],
+        })
+    return {
+        'rows': rows,
+        'log_ratio': log_ratio_sum / len(log_ratios),
+        'score': total_score,
+    }
+
+
+def generate_correctness_table(data, data_length):
+    correctness = score_correctness(data)
+    output = '\\begin{tabular}{r|%s|cc}\n' % ('c' * data_length)
+    output += 'Test Case & \\multicolumn{%d}{c|}{Time (second)} & Score & Out of  \\\\\\hline' % data_length
+    for row in correctness['rows']:
+        result_times = generate_result_times(data[row['query']], data_length)
+        output += '\n%s & %s & %s & %s \\\\' % (row['query'][5:], result_times, row['score'], row['out_of'])
+    output += '\\hline'
     first = True
-    for query, score in LISTEN_QUERY:
+    for query in correctness['listen']:
         result = data[query]
         result_times = generate_result_times(result, data_length)
         ending = ''
         if first:
             first = False
-            ending += '\\multirow{%d}{*}{%d} & ' % (len(LISTEN_QUERY), listen_score)
-            ending += '\\multirow{%d}{*}{%d}' % (len(LISTEN_QUERY), 10)
+            ending += '\\multirow{%d}{*}{%d} & ' % (len(LISTEN_QUERY), correctness['listen_score'])
+            ending += '\\multirow{%d}{*}{%d}' % (len(LISTEN_QUERY), correctness['listen_out_of'])
         output += '\n%s & %s & %s \\\\' % (query[5:].replace('_', ' '), result_times, ending)
     output += '\\hline'
-    output += '\nTotal & \\multicolumn{%d}{c|}{/} & %d & %d' % (data_length, total_score, 30)
+    output += '\nTotal & \\multicolumn{%d}{c|}{/} & %d & %d' % (data_length, correctness['score'],
+                                                              correctness['out_of'])
     output += '\n\\end{tabular}\n'
     # print(output)
     return output
 
 
 def generate_performance_table(data, data_length, base_data):
+    performance = score_performance(data, base_data)
     output = '\\begin{tabular}{r|%s|cc|cc}\n' % ('c' * data_length)
     output += 'Test Case & \\multicolumn{%d}{c|}{Time (second)} & Average & Base & LogRatio & Score \\\\\\hline' % data_length
 
-    log_ratios = []
-    for query, score in PERFORMANCE_QUERY:
-        result = data[query]
-        log_ratio = 0
-        if result['overall_status'] == 'AC':
-            log_ratio = max(0.0, math.log2(base_data[query]['average_time'] / result['average_time']))
-        log_ratios.append(log_ratio)
-    log_ratio_stddev = statistics.stdev(log_ratios)
-    log_ratio_sum = sum(log_ratios)
-    total_score = 60 * max(0.0, log_ratio_sum / len(log_ratios)) / (0.6 + 0.2 * log_ratio_stddev)
-
-    for i, (query, score) in enumerate(PERFORMANCE_QUERY):
-        result = data[query]
-        result_times = generate_result_times(result, data_length, True)
-        base_time = base_data[query]['average_time']
+    for row in performance['rows']:
+        result_times = generate_result_times(data[row['query']], data_length, True)
         average_time = '/'
-        log_ratio = log_ratios[i]
-        if log_ratio_sum == 0:
-            score = 0
-        else:
-            score = total_score * log_ratio / log_ratio_sum
-        if result['overall_status'] == 'AC':
-            average_time = '%.3f' % result['average_time']
+        if row['average_time'] is not None:
+            average_time = '%.3f' % row['average_time']
         output += '\n%s & %s & %s & %.3f & %.3f & %.3f \\\\' % (
-            query.replace('_', ' '), result_times, average_time, base_time, log_ratio, score)
+            row['query'].replace('_', ' '), result_times, average_time, row['base_time'], row['log_ratio'], row['score'])
 
     output += '\\hline'
     output += '\nTotal & \\multicolumn{%d}{c|}{/} & \\multicolumn{2}{c|}{/} & %.3f & %.3f' % (
-        data_length, log_ratio_sum / len(log_ratios), total_score)
+        data_length, performance['log_ratio'], performance['score'])
     output += '\n\\end{tabular}\n'
     # print(output)
     return output
 
 
-def generate_contribution_table(data, _author_sjtu_id, _sjtu_id_list):
-    output = '\\begin{tabular}{r|cc|cc|cc}\n'
-    output += 'Author & Lines & \\% & Commits & \\% & Files & \\% \\\\\\hline'
-    total_lines = 0
-    total_lines_percent = 0.0
-    total_commits = 0
-    total_commits_percent = 0.0
-    total_files = 0
-    total_files_percent = 0.0
+def generate_usage_table(data):
+    import humanize
+
+    output = '\\begin{tabular}{r|cc|c|c|cc|cc}\n'
+    output += 'Test Case & User (s) & Sys (s) & Cores & Peak RSS & Vol. CS & Invol. CS & Read & Write \\\\\\hline'
+    for query, score in CORRECTNESS_QUERY + LISTEN_QUERY + PERFORMANCE_QUERY:
+        if query not in data:
+            continue
+        usage = data[query]
+        output += '\n%s & %.3f & %.3f & %.2f & %s & %d & %d & %s & %s \\\\' % (
+            query.replace('_', ' '), usage['user_time'], usage['sys_time'], usage['cores'],
+            humanize.naturalsize(usage['max_rss'], gnu=True), usage['voluntary_switches'],
+            usage['involuntary_switches'], humanize.naturalsize(usage['read_bytes'], gnu=True),
+            humanize.naturalsize(usage['write_bytes'], gnu=True))
+    output += '\n\\end{tabular}\n'
+    return output
+
+
+def generate_scaling_table(data):
+    threads_list = sorted(set(threads for rows in data.values() for threads in rows.keys()))
+    output = '\\begin{tabular}{r|%s}\n' % '|'.join(['ccc'] * len(threads_list))
+    output += 'Test Case & %s \\\\\n' % ' & '.join(
+        map(lambda x: '\\multicolumn{3}{c%s}{%d Threads}' % (x < threads_list[-1] and '|' or '', x), threads_list))
+    output += ' & %s \\\\\\hline' % ' & '.join(['Time & Speedup & Efficiency'] * len(threads_list))
+    for query, rows in data.items():
+        output += '\n%s' % query.replace('_', ' ')
+        for threads in threads_list:
+            row = rows.get(threads)
+            if row is None:
+                output += ' & / & / & /'
+            elif row['status'] != 'AC':
+                output += ' & {\\color{red}%s} & / & /' % row['status']
+            else:
+                output += ' & %.3f & %.2f & %.0f\\%%' % (row['average'], row['speedup'], row['efficiency'] * 100)
+        output += ' \\\\'
+    output += '\n\\end{tabular}\n'
+    return output
+
+
+def generate_latency_table(data):
+    total_time = sum(map(lambda x: x['total'], data.values())) or 1
+    output = '\\begin{tabular}{r|cc|cc|c|%s}\n' % ('c' * len(HISTOGRAM_NAMES))
+    output += 'Query Type & Count & Share & Mean (ms) & Worst p99 (ms) & Max (ms) & %s \\\\\\hline' % ' & '.join(
+        map(lambda x: tex_escape(x), HISTOGRAM_NAMES))
+    for query_type, latency in sorted(data.items(), key=lambda x: -x[1]['total']):
+        output += '\n%s & %d & %.1f\\%% & %.3f & %.3f & %.3f & %s \\\\' % (
+            query_type, latency['count'], latency['total'] / total_time * 100, latency['total'] / latency['count'] * 1000,
+            latency['p99'] * 1000, latency['max'] * 1000, ' & '.join(map(str, latency['histogram'])))
+    output += '\n\\end{tabular}\n'
+    return output
+
+
+def merge_contribution(data, _author_sjtu_id, _sjtu_id_list):
+    """
+        :param data: contribution of every git author
+        :return: contribution of every student, whose git authors are listed in commit.json, and the total
+    """
     new_data = []
 
     for _sjtu_id in _sjtu_id_list:
@@ -220,18 +314,26 @@ def generate_contribution_table(data, _author_sjtu_id, _sjtu_id_list):
         # else:
         #     new_data.append(result)
 
+    total = {'author': 'Total', 'lines': 0, 'lines%': 0.0, 'commits': 0, 'commits%': 0.0, 'files': 0, 'files%': 0.0}
+    for result in new_data:
+        for _key in total.keys():
+            if _key != 'author':
+                total[_key] += result[_key]
+    return new_data, total
+
+
+def generate_contribution_table(data, _author_sjtu_id, _sjtu_id_list):
+    output = '\\begin{tabular}{r|cc|cc|cc}\n'
+    output += 'Author & Lines & \\% & Commits & \\% & Files & \\% \\\\\\hline'
+    new_data, total = merge_contribution(data, _author_sjtu_id, _sjtu_id_list)
+
     for result in new_data:
-        total_lines += int(result['lines'])
-        total_lines_percent += result['lines%']
-        total_commits += int(result['commits'])
-        total_commits_percent += (result['commits%'])
-        total_files += int(result['files'])
-        total_files_percent += (result['files%'])
         output += '\n %s & %s & %s & %s & %s & %s & %s \\\\' % \
                   (tex_escape(result['author']), result['lines'], result['lines%'],
                    result['commits'], result['commits%'], result['files'], result['files%'])
     output += '\\hline'
-    output += '\nTotal & %d & %.1f & %d & %.1f & %d & %.1f' % (total_lines,total_lines_percent, total_commits,total_commits_percent, total_files,total_files_percent)
+    output += '\nTotal & %d & %.1f & %d & %.1f & %d & %.1f' % (total['lines'], total['lines%'], total['commits'],
+                                                             total['commits%'], total['files'], total['files%'])
     output += '\n\\end{tabular}\n'
     # print(output)
     return output
@@ -287,35 +389,92 @@ def get_query_data(time_path, status_path):
     return query_data, query_data_length
 
 
+def get_run_query_data(runs):
+    """
+        :param runs: runs of a session in the result store
+        :return: the same as get_query_data
+    """
+    query_data = {}
+    query_data_length = 0
+    for run in runs:
+        data = query_data.setdefault(run['query'], {'time_data': [], 'status_data': []})
+        data['time_data'].append(run['time'])
+        data['status_data'].append(run['status'])
+        query_data_length = max(query_data_length, len(data['time_data']))
+    for data in query_data.values():
+        data['average_time'] = calculate_average_time(data['time_data'])
+        data['overall_status'] = all(map(lambda x: x == "AC", data['status_data'])) and "AC" or "ERR"
+    return query_data, query_data_length
+
+
+def get_usage_data(usage_path):
+    with open(usage_path) as usage_file:
+        return get_run_usage_data(csv.DictReader(usage_file))
+
+
+def get_run_usage_data(rows):
+    """
+        :return: usage of every query averaged over its runs, the peak RSS is the maximum
+    """
+    runs = {}
+    for row in rows:
+        if row['user_time'] in ('', None):
+            continue
+        runs.setdefault(row['query'], []).append(row)
+    usage_data = {}
+    for query, rows in runs.items():
+        usage = {}
+        for field in USAGE_FIELDS:
+            usage[field] = statistics.mean(map(lambda x: float(x[field]), rows))
+        usage['max_rss'] = max(map(lambda x: int(x['max_rss']), rows))
+        wall_time = statistics.mean(map(lambda x: float(x['time']), rows))
+        # average number of busy cores, (user + sys) / wall
+        usage['cores'] = wall_time and (usage['user_time'] + usage['sys_time']) / wall_time
+        usage_data[query] = usage
+    return usage_data
+
+
+def get_scaling_data(scaling_path):
+    scaling_data = {}
+    with open(scaling_path) as scaling_file:
+        reader = csv.DictReader(scaling_file)
+        for row in reader:
+            scaling_data.setdefault(row['query'], {})[int(row['threads'])] = {
+                'status': row['status'],
+                'average': row['average'] and float(row['average']),
+                'speedup': row['speedup'] and float(row['speedup']),
+                'efficiency': row['efficiency'] and float(row['efficiency']),
+            }
+    return scaling_data
+
+
+def get_latency_data(latency_path):
+    """
+        :return: latency of every query type over all queries, the percentiles of different
+                 queries can not be merged, so the worst p99 is kept
+    """
+    latency_data = {}
+    with open(latency_path) as latency_file:
+        reader = csv.DictReader(latency_file)
+        for row in reader:
+            latency = latency_data.setdefault(row['type'], {
+                'count': 0, 'total': 0, 'p99': 0, 'max': 0, 'histogram': [0] * len(HISTOGRAM_NAMES)})
+            latency['count'] += int(row['count'])
+            latency['total'] += float(row['total'])
+            latency['p99'] = max(latency['p99'], float(row['p99']))
+            latency['max'] = max(latency['max'], float(row['max']))
+            latency['histogram'] = list(map(lambda x: x[0] + int(row[x[1]]),
+                                            zip(latency['histogram'], HISTOGRAM_NAMES)))
+    return latency_data
+
+
 def get_git_data(project_dir):
-    p = subprocess.run(
-        ['python3', '-m', 'gitfame', '--sort=commits', '-wt', '--incl=.*\\.[cht][ph]{0,2}$', '--format=csv',
-         project_dir],
-        stdout=subprocess.PIPE,
-        universal_newlines=True
-    )
-    reader = csv.reader(p.stdout.split('\n'))
-    first = True
+    import git
+
     git_data = {
-        'contribution': [],
+        'contribution': get_contribution(project_dir),
         'log': [],
     }
-    for row in reader:
-        if first:
-            first = False
-            # print(row)
-        elif len(row) == 0:
-            break
-        else:
-            git_data['contribution'].append({
-                'author': row[0],
-                'lines': row[1],
-                'lines%': row[4],
-                'commits': row[2],
-                'commits%': row[5],
-                'files': row[3],
-                'files%': row[6]
-            })
 
     repo = git.Repo(project_dir)
     for commit in repo.iter_commits('master'):
@@ -330,27 +489,81 @@ def get_git_data(project_dir):
     return git_data
 
 
-@click.command()
-@click.option('-p', '--project-dir', required=True, help='LemonDB Directory (a git repo).')
-@click.option('-t', '--team', required=True, help='Group Number.')
-def main(project_dir, team):
-    time_path = os.path.join(project_dir, 'time.csv')
-    status_path = os.path.join(project_dir, 'status.csv')
+REPORT_FORMATS = ['pdf', 'html', 'json']
+TEMPLATE_FILES = {
+    'pdf': os.path.join('report', 'report.tex'),
+    'html': os.path.join('report', 'report.html'),
+}
 
-    git_data = get_git_data(project_dir)
 
-    query_data, query_data_length = get_query_data(time_path, status_path)
+def load_shared(results_db, formats=('pdf',)):
+    """
+        Inputs shared by the reports of all teams, computed once.
+    """
+    template_sources = {}
+    for report_format in formats:
+        if report_format in TEMPLATE_FILES:
+            with open(TEMPLATE_FILES[report_format]) as file:
+                template_sources[report_format] = file.read()
     base_query_data, base_query_data_length = get_query_data('time.csv', 'status.csv')
+    return {
+        'platform_info': get_platform(),
+        'template_sources': template_sources,
+        'base_query_data': base_query_data,
+        'results_db': results_db,
+        'formats': list(formats),
+    }
+
+
+def compile_templates(shared):
+    import humanize
+    import jinja2
+
+    templates = {}
+    for report_format, source in shared['template_sources'].items():
+        if report_format == 'html':
+            environment = jinja2.Environment(autoescape=True, trim_blocks=True, lstrip_blocks=True)
+            environment.filters['naturalsize'] = lambda x: humanize.naturalsize(x, gnu=True)
+            templates[report_format] = environment.from_string(source)
+        else:
+            templates[report_format] = jinja2.Template(source)
+    return templates
+
+
+def collect_report_data(project_dir, team, shared):
+    """
+        Everything in the report of a team, the same for all formats.
+        :return: dict of the times and status of every run, the scores and the optional sections
+    """
+    usage_path = os.path.join(project_dir, 'usage.csv')
+    scaling_path = os.path.join(project_dir, 'scaling.csv')
+    latency_path = os.path.join(project_dir, 'latency.csv')
+    results_db = shared['results_db']
+
+    git_data = get_git_data(project_dir)
+
+    session_id = None
+    if os.path.exists(results_db):
+        store = ResultStore(results_db)
+        # sweeps and interrupted sessions are not graded, neither are sessions without all the queries
+        session_id = store.last_session(project_dir, 'grade', shared['base_query_data'].keys())
+        if session_id:
+            runs = store.runs(session_id)
+        store.close()
+    if session_id:
+        # the last complete grading session of the project, csv files may be left from an older one
+        query_data, query_data_length = get_run_query_data(runs)
+        usage_data = get_run_usage_data(runs)
+    else:
+        query_data, query_data_length = get_query_data(os.path.join(project_dir, 'time.csv'),
+                                                       os.path.join(project_dir, 'status.csv'))
+        usage_data = os.path.exists(usage_path) and get_usage_data(usage_path)
 
     # print(query_data_length)
     # print(query_data)
 
-    with open(os.path.join('report', 'report.tex')) as file:
-        template = jinja2.Template(file.read())
+    import chardet
 
-    platform_info = get_platform()
-    for key in platform_info.keys():
-        platform_info[key] = tex_escape(str(platform_info[key]))
     commit_json_file = os.path.join(project_dir, 'commit.json')
     author_sjtu_id = {}
     sjtu_id_list = []
@@ -365,28 +578,183 @@ def main(project_dir, team):
             for _sjtu_id,git_usernames in sjtu_id_author.items():
                 for _username in git_usernames:
                     author_sjtu_id[_username] = _sjtu_id
-    
-    template_data = {
+
+    return {
         'team': team,
-        'correctness': generate_correctness_table(query_data, query_data_length),
-        'performance': generate_performance_table(query_data, query_data_length, base_query_data),
-        'contribution': generate_contribution_table(git_data['contribution'],author_sjtu_id,sjtu_id_list),
-        'log': generate_git_log(git_data['log']),
-        **platform_info
+        'platform': shared['platform_info'],
+        'queries': query_data,
+        'iterations': query_data_length,
+        'base_queries': shared['base_query_data'],
+        'usage': usage_data or None,
+        'scaling': os.path.exists(scaling_path) and get_scaling_data(scaling_path) or None,
+        'latency': os.path.exists(latency_path) and get_latency_data(latency_path) or None,
+        'git_contribution': git_data['contribution'],
+        'author_sjtu_id': author_sjtu_id,
+        'sjtu_id_list': list(sjtu_id_list),
+        'log': git_data['log'],
+    }
+
+
+def render_pdf(data, template, pdf_path):
+    template_data = {
+        'team': data['team'],
+        'correctness': generate_correctness_table(data['queries'], data['iterations']),
+        'performance': generate_performance_table(data['queries'], data['iterations'], data['base_queries']),
+        'usage': data['usage'] and generate_usage_table(data['usage']),
+        'scaling': data['scaling'] and generate_scaling_table(data['scaling']),
+        'latency': data['latency'] and generate_latency_table(data['latency']),
+        'contribution': generate_contribution_table(data['git_contribution'], data['author_sjtu_id'],
+                                                    data['sjtu_id_list']),
+        'log': generate_git_log(data['log']),
+        **{key: tex_escape(str(value)) for key, value in data['platform'].items()}
     }
 
     output_dir = tempfile.mkdtemp(prefix='lemondb.', suffix='.report')
-    shutil.copytree('report', output_dir, dirs_exist_ok=True)
-    report_path = os.path.abspath(os.path.join(output_dir, 'report.tex'))
+    try:
+        shutil.copytree('report', output_dir, dirs_exist_ok=True)
+        report_path = os.path.abspath(os.path.join(output_dir, 'report.tex'))
+
+        with open(report_path, 'w') as file:
+            file.write(template.render(**template_data))
+
+        command = 'xelatex -shell-escape -synctex=1 -interaction=nonstopmode %s' % report_path
+        args = shlex.split(command)
+        subprocess.run(args, cwd=output_dir, stdout=subprocess.PIPE)
+        shutil.copy2(os.path.join(output_dir, 'report.pdf'), pdf_path)
+    finally:
+        # the reports of other teams are still generated when one fails
+        shutil.rmtree(output_dir)
+
+
+def get_report_document(data):
+    """
+        :return: the report as plain values, the tables of the pdf computed by score_correctness,
+                 score_performance and merge_contribution, with the times of every run
+    """
+    contribution, contribution_total = merge_contribution(data['git_contribution'], data['author_sjtu_id'],
+                                                          data['sjtu_id_list'])
+    return {
+        'team': data['team'],
+        'platform': data['platform'],
+        'iterations': data['iterations'],
+        'queries': data['queries'],
+        'correctness': score_correctness(data['queries']),
+        'performance': score_performance(data['queries'], data['base_queries']),
+        'usage': data['usage'],
+        'scaling': data['scaling'],
+        'latency': data['latency'],
+        'histogram': HISTOGRAM_NAMES,
+        'contribution': contribution,
+        'contribution_total': contribution_total,
+        'log': data['log'],
+    }
+
 
-    with open(report_path, 'w') as file:
-        file.write(template.render(**template_data))
+def render_html(data, template, html_path):
+    with open(html_path, 'w') as file:
+        file.write(template.render(**get_report_document(data)))
 
-    command = 'xelatex -shell-escape -synctex=1 -interaction=nonstopmode %s' % report_path
-    args = shlex.split(command)
-    subprocess.run(args, cwd=output_dir, stdout=subprocess.PIPE)
-    shutil.copy2(os.path.join(output_dir, 'report.pdf'), os.path.join(project_dir, 'team%s_report.pdf') % team)
-    shutil.rmtree(output_dir)
+
+def render_json(data, json_path):
+    with open(json_path, 'w') as file:
+        json.dump(get_report_document(data), file, indent=2)
+
+
+def generate_report(project_dir, team, shared, templates=None):
+    """
+        :return: paths of the reports in every format of shared, in the project dir
+    """
+    templates = templates or compile_templates(shared)
+    data = collect_report_data(project_dir, team, shared)
+    report_paths = []
+    # the fast formats first, they are kept when xelatex fails
+    for report_format in sorted(shared['formats'], key=lambda x: x == 'pdf'):
+        report_path = os.path.join(project_dir, 'team%s_report.%s' % (team, report_format))
+        try:
+            if report_format == 'pdf':
+                render_pdf(data, templates['pdf'], report_path)
+            elif report_format == 'html':
+                render_html(data, templates['html'], report_path)
+            else:
+                render_json(data, report_path)
+            report_paths.append(report_path)
+        except Exception as e:
+            if len(shared['formats']) == 1:
+                raise
+            logger.error('%s report of %s failed: %s', report_format, project_dir, e)
+    return report_paths
+
+
+# shared inputs and the templates compiled once in every worker of the batch mode
+worker_shared = None
+worker_templates = None
+
+
+def __init_worker(shared):
+    global worker_shared, worker_templates
+    worker_shared = shared
+    worker_templates = compile_templates(shared)
+
+
+def __generate_report(project_dir, team):
+    return generate_report(project_dir, team, worker_shared, worker_templates)
+
+
+def find_projects(all_dir):
+    """
+        :return: (project dir, team) of every git repo in all_dir, the team is the number at
+                 the end of the directory name, such as 07 for pgroup-07
+    """
+    projects = []
+    for name in sorted(os.listdir(all_dir)):
+        project_dir = os.path.join(all_dir, name)
+        if not os.path.isdir(os.path.join(project_dir, '.git')):
+            continue
+        team = re.search(r'(\d+)$', name)
+        projects.append((project_dir, team and team.group(1) or name))
+    return projects
+
+
+@click.command()
+@click.option('-p', '--project-dir', help='LemonDB Directory (a git repo).')
+@click.option('-t', '--team', help='Group Number.')
+@click.option('--all', 'all_dir', help='Generate the reports of all git repos in this directory.')
+@click.option('-j', '--jobs', default=os.cpu_count(), type=int, help='Number of reports generated at the same time.')
+@click.option('-o', '--output-dir', help='Also copy the reports into this directory.')
+@click.option('-f', '--format', 'formats', multiple=True, default=['pdf'], type=click.Choice(REPORT_FORMATS),
+              help='Format of the reports, may be repeated. html and json do not need LaTeX.')
+@click.option('--results-db', default=RESULTS_DB, help='SQLite database of the results, CSV files are used without it.')
+def main(project_dir, team, all_dir, jobs, output_dir, formats, results_db):
+    if all_dir:
+        projects = find_projects(all_dir)
+    elif project_dir and team:
+        projects = [(project_dir, team)]
+    else:
+        logger.error('Error: either --all or both --project-dir and --team are required!')
+        exit(-1)
+
+    shared = load_shared(results_db, formats)
+    report_paths = []
+    if len(projects) == 1 or jobs <= 1:
+        templates = compile_templates(shared)
+        for project_dir, team in projects:
+            report_paths += generate_report(project_dir, team, shared, templates)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(jobs, len(projects)), initializer=__init_worker,
+                                                    initargs=(shared,)) as executor:
+            futures = {executor.submit(__generate_report, project_dir, team): project_dir
+                       for project_dir, team in projects}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    report_paths += future.result()
+                    logger.info('Report of %s generated', futures[future])
+                except Exception as e:
+                    logger.error('Report of %s failed: %s', futures[future], e)
+
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+        for report_path in report_paths:
+            shutil.copy2(report_path, output_dir)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,180 @@
+"""
+LemonDB Result Store
+"""
+
+import json
+import os
+import sqlite3
+import subprocess
+import time
+
+import click
+from logzero import logger
+
+from usage import USAGE_FIELDS
+
+RESULTS_DB = 'results.db'
+RUN_FIELDS = ['query', 'threads', 'iteration', 'status', 'time'] + USAGE_FIELDS
+# a grading session runs every query with one thread count, a sweep with several
+SESSION_KINDS = ['grade', 'sweep']
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS session (
+    id INTEGER PRIMARY KEY,
+    project TEXT NOT NULL,
+    commit_hash TEXT,
+    program_hash TEXT NOT NULL,
+    settings TEXT NOT NULL,
+    started REAL NOT NULL,
+    kind TEXT NOT NULL DEFAULT 'grade',
+    complete INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS session_project ON session (project, started);
+CREATE INDEX IF NOT EXISTS session_commit ON session (commit_hash);
+CREATE TABLE IF NOT EXISTS run (
+    id INTEGER PRIMARY KEY,
+    session_id INTEGER NOT NULL REFERENCES session (id),
+    query TEXT NOT NULL,
+    threads INTEGER NOT NULL,
+    iteration INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    time REAL NOT NULL,
+    %s
+);
+CREATE INDEX IF NOT EXISTS run_session ON run (session_id, query, threads, iteration);
+CREATE INDEX IF NOT EXISTS run_query ON run (query, session_id);
+''' % ',\n    '.join(map(lambda x: '%s %s' % (x, x.endswith('time') and 'REAL' or 'INTEGER'), USAGE_FIELDS))
+
+
+def get_commit_hash(project_dir):
+    p = subprocess.run(['git', '-C', project_dir, 'rev-parse', 'HEAD'], stdout=subprocess.PIPE,
+                       stderr=subprocess.DEVNULL, universal_newlines=True)
+    return p.stdout.strip() if p.returncode == 0 else None
+
+
+class ResultStore:
+    """
+        Every run of every session in SQLite, so that the history of a project can be
+        queried without running it again. Several graders may write at the same time.
+    """
+
+    def __init__(self, path=RESULTS_DB):
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript(SCHEMA)
+        self.__migrate()
+        self.session_id = None
+
+    def __migrate(self):
+        # databases from before the kind of sessions, their sessions are all treated as incomplete
+        columns = set(map(lambda x: x['name'], self.connection.execute('PRAGMA table_info(session)')))
+        try:
+            with self.connection:
+                if 'kind' not in columns:
+                    self.connection.execute("ALTER TABLE session ADD COLUMN kind TEXT NOT NULL DEFAULT 'grade'")
+                if 'complete' not in columns:
+                    self.connection.execute('ALTER TABLE session ADD COLUMN complete INTEGER NOT NULL DEFAULT 0')
+        except sqlite3.OperationalError:
+            # another grader added them at the same time
+            pass
+
+    def open_session(self, project_dir, session, kind='grade', resume=False):
+        """
+        :param session: program hash and settings, as in the journal
+        :param kind: one of SESSION_KINDS
+        :param resume: continue the last session of the project with the same kind and settings
+        :return: session id, the runs added later belong to it
+        """
+        project = os.path.abspath(project_dir)
+        settings = json.dumps(session, sort_keys=True)
+        if resume:
+            row = self.connection.execute(
+                'SELECT id FROM session WHERE project = ? AND kind = ? AND settings = ? ORDER BY started DESC LIMIT 1',
+                (project, kind, settings)).fetchone()
+            if row:
+                self.session_id = row['id']
+                return self.session_id
+        with self.connection:
+            cursor = self.connection.execute(
+                'INSERT INTO session (project, commit_hash, program_hash, settings, started, kind) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (project, get_commit_hash(project), session['program'], settings, time.time(), kind))
+        self.session_id = cursor.lastrowid
+        return self.session_id
+
+    def finish_session(self):
+        """
+            Mark the session complete once all its queries are run, interrupted sessions stay incomplete.
+        """
+        with self.connection:
+            self.connection.execute('UPDATE session SET complete = 1 WHERE id = ?', (self.session_id,))
+
+    def add_run(self, query, threads, iteration, result):
+        status, realtime, usage = result
+        with self.connection:
+            self.connection.execute(
+                'INSERT INTO run (session_id, %s) VALUES (?, %s)' % (
+                    ', '.join(RUN_FIELDS), ', '.join(['?'] * len(RUN_FIELDS))),
+                [self.session_id, query, threads, iteration, status, realtime] +
+                list(map(lambda x: usage.get(x), USAGE_FIELDS)))
+
+    def last_session(self, project_dir, kind='grade', queries=None):
+        """
+            :param queries: names of the queries the session must have run, None for any
+            :return: id of the last complete session of the kind, None if there is none
+        """
+        for row in self.connection.execute(
+                'SELECT id, settings FROM session WHERE project = ? AND kind = ? AND complete ORDER BY started DESC',
+                (os.path.abspath(project_dir), kind)):
+            # the queries are [name, unit time] in test.py and names in coordinator.py
+            names = set(map(lambda x: isinstance(x, list) and x[0] or x, json.loads(row['settings'])['queries']))
+            if queries is None or names.issuperset(queries):
+                return row['id']
+        return None
+
+    def runs(self, session_id):
+        """
+            :return: runs of a session as dicts of RUN_FIELDS, ordered by query, threads and iteration,
+                     the coordinator adds them in the order they finished
+        """
+        return list(map(dict, self.connection.execute(
+            'SELECT %s FROM run WHERE session_id = ? ORDER BY query, threads, iteration, id' % ', '.join(RUN_FIELDS),
+            (session_id,))))
+
+    def history(self, project_dir, query, limit=20):
+        """
+            :return: one row for each of the last sessions of a project that ran the query,
+                     with its commit, number of runs, accepted runs and their average time
+        """
+        return list(map(dict, self.connection.execute('''
+            SELECT session.id, session.commit_hash, session.started, COUNT(*) AS runs,
+                   SUM(run.status = 'AC') AS accepted, AVG(CASE WHEN run.status = 'AC' THEN run.time END) AS average
+            FROM session JOIN run ON run.session_id = session.id
+            WHERE session.project = ? AND run.query = ?
+            GROUP BY session.id ORDER BY session.started DESC LIMIT ?''',
+                                                        (os.path.abspath(project_dir), query, limit))))
+
+    def close(self):
+        self.connection.close()
+
+
+@click.command()
+@click.option('-p', '--project-dir', required=True, help='LemonDB Directory.')
+@click.option('-q', '--query', required=True, help='Query to show the history of.')
+@click.option('-n', '--limit', default=20, type=int, help='Number of the last sessions.')
+@click.option('--results-db', default=RESULTS_DB, help='SQLite database of the results.')
+def main(project_dir, query, limit, results_db):
+    if not os.path.exists(results_db):
+        logger.error('Error: %s not found!', results_db)
+        exit(-1)
+    store = ResultStore(results_db)
+    for row in reversed(store.history(project_dir, query, limit)):
+        print('%s %s %d/%d AC %.3f s' % (time.strftime('%Y-%m-%d %H:%M', time.localtime(row['started'])),
+                                         (row['commit_hash'] or '-')[:10], row['accepted'], row['runs'],
+                                         row['average'] or 0))
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
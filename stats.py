@@ -0,0 +1,78 @@
+"""
+LemonDB Benchmark Statistics
+"""
+
+import math
+import statistics
+
+
+def t_quantile(p, df):
+    """
+        Quantile of Student's t distribution, exact for 1 and 2 degrees of freedom,
+        otherwise the Cornish-Fisher expansion around the normal quantile.
+    """
+    if df == 1:
+        return math.tan(math.pi * (p - 0.5))
+    if df == 2:
+        return (2 * p - 1) * math.sqrt(2 / (4 * p * (1 - p)))
+    z = statistics.NormalDist().inv_cdf(p)
+    return z + (z ** 3 + z) / (4 * df) + \
+        (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * df ** 2) + \
+        (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / (384 * df ** 3) + \
+        (79 * z ** 9 + 776 * z ** 7 + 1482 * z ** 5 - 1920 * z ** 3 - 945 * z) / (92160 * df ** 4)
+
+
+def confidence_interval(data, confidence=0.95, center='median'):
+    """
+        :param center: 'mean' uses the t distribution, 'median' the distribution-free order statistics
+        :return: center, lower bound, upper bound
+    """
+    n = len(data)
+    if n < 2:
+        value = n and data[0] or 0.0
+        return value, -math.inf, math.inf
+    if center == 'mean':
+        mean = statistics.mean(data)
+        half = t_quantile((1 + confidence) / 2, n - 1) * statistics.stdev(data) / math.sqrt(n)
+        return mean, mean - half, mean + half
+    data = sorted(data)
+    z = statistics.NormalDist().inv_cdf((1 + confidence) / 2)
+    # ranks of the bounds, from the normal approximation of the binomial distribution
+    lower = math.floor(n / 2 - z * math.sqrt(n) / 2)
+    upper = math.ceil(1 + n / 2 + z * math.sqrt(n) / 2)
+    if lower < 1 or upper > n:
+        return statistics.median(data), -math.inf, math.inf
+    return statistics.median(data), data[lower - 1], data[upper - 1]
+
+
+def relative_width(data, confidence=0.95, center='median'):
+    value, lower, upper = confidence_interval(data, confidence, center)
+    if value <= 0:
+        return math.inf
+    return (upper - lower) / value
+
+
+def find_outliers(data):
+    """
+        :return: indices of the values outside of Tukey's fences (1.5 IQR)
+    """
+    if len(data) < 4:
+        return []
+    q1, q2, q3 = statistics.quantiles(data, n=4)
+    low, high = q1 - 1.5 * (q3 - q1), q3 + 1.5 * (q3 - q1)
+    return [i for i, x in enumerate(data) if x < low or x > high]
+
+
+def summarize(data, confidence=0.95, center='median'):
+    value, lower, upper = confidence_interval(data, confidence, center)
+    return {
+        'n': len(data),
+        'mean': len(data) and statistics.mean(data) or 0.0,
+        'median': len(data) and statistics.median(data) or 0.0,
+        'stdev': len(data) > 1 and statistics.stdev(data) or 0.0,
+        'variance': len(data) > 1 and statistics.variance(data) or 0.0,
+        'ci_low': lower,
+        'ci_high': upper,
+        'relative_width': relative_width(data, confidence, center),
+        'outliers': find_outliers(data),
+    }
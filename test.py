@@ -5,23 +5,34 @@ by tc-imba <liuyh615@sjtu.edu.cn>
 
 import csv
 import os
+import queue
 import shutil
+import selectors
+import signal
 import subprocess
 import time
 import multiprocessing
-import threading
-from queue import Queue
-import re
-import platform
+import concurrent.futures
 
 import click
-import cpuinfo
-import humanize
-import psutil
-import memory_tempfile
-import progressbar
 from logzero import logger
-import enlighten
+
+from probe import get_platform
+from build_cache import hash_project, cached_program, store_program
+from journal import Journal, JOURNAL_NAME
+from result_store import ResultStore, RESULTS_DB
+from latency import query_types, LatencyTrace, LATENCY_FIELDS, new_summary, merge_summary, summarize_latency
+from query_index import read_query, hash_file
+from feeder import QueryFeeder
+from pump import pump, CHUNK_SIZE
+from usage import wait_usage, PeakRss, USAGE_FIELDS
+from stats import relative_width, summarize
+from verify import digest_dir, digest_file, digest_blocks, compare_digests, explain_mismatch, manifest_path, \
+    save_manifest, load_manifest, load_progress, load_stdout_check, StdoutChecker, StdoutMismatch, STDOUT_BLOCK_LINES, \
+    STDOUT_BLOCK_BYTES, digest_raw_blocks
+from progress_watchdog import ProgressWatchdog, HopelessRun, WATCHDOG_MARGIN
+from memory_limit import MemoryLimit, MemoryLimitExceeded, cgroup_name, enable_memory_controller, parse_size, \
+    remove_cgroup
 
 TEST_QUERY = [
     # ('test_quit', 0),
@@ -52,55 +63,75 @@ TEST_QUERY = [
 
 def execute(*args):
     p = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    while p.poll() is None:
-        flag = True
-        while True:
-            out = p.stdout.readline()
-            if out:
-                logger.info(out.decode('utf-8').strip('\n'))
-                flag = False
-            else:
-                break
-        while True:
-            err = p.stderr.readline()
-            if err:
-                logger.warning(err.decode('utf-8').strip('\n'))
-                flag = False
+    log = {p.stdout.fileno(): logger.info, p.stderr.fileno(): logger.warning}
+    tails = {p.stdout.fileno(): b'', p.stderr.fileno(): b''}
+    selector = selectors.DefaultSelector()
+    for fd in log.keys():
+        selector.register(fd, selectors.EVENT_READ)
+    while len(selector.get_map()) > 0:
+        for key, events in selector.select():
+            chunk = os.read(key.fd, CHUNK_SIZE)
+            if not chunk:
+                selector.unregister(key.fd)
+                lines = [tails[key.fd]] if tails[key.fd] else []
             else:
-                break
-        if flag:
-            time.sleep(0.1)
-    return p.returncode
+                lines = (tails[key.fd] + chunk).split(b'\n')
+                tails[key.fd] = lines.pop()
+            for line in lines:
+                log[key.fd](line.decode('utf-8', 'replace'))
+    selector.close()
+    return p.wait()
+
+
+BUILD_TYPE = 'Release'
+# seconds between two checks whether a run process died without a result
+RESULT_POLL_INTERVAL = 1.0
 
 
 def build(project_dir, build_dir, threads, clean=False):
     working_dir = os.getcwd()
     logger.info("Build program for %s", project_dir)
 
-    os.chdir(project_dir)
-    if clean:
-        shutil.rmtree(build_dir, ignore_errors=True)
-    os.makedirs(build_dir, exist_ok=True)
-    os.chdir(build_dir)
-
-    # if execute("cmake", "-DCMAKE_BUILD_TYPE=Debug", "..") != 0:
-    if execute("cmake", "-DCMAKE_BUILD_TYPE=Release", "..") != 0:
-        logger.error("CMake failed!")
-        exit(-1)
+    # callers which catch the exit of a failed build go on from their own working dir
+    try:
+        os.chdir(project_dir)
+        if clean:
+            shutil.rmtree(build_dir, ignore_errors=True)
+        os.makedirs(build_dir, exist_ok=True)
+        os.chdir(build_dir)
+
+        # if execute("cmake", "-DCMAKE_BUILD_TYPE=Debug", "..") != 0:
+        if execute("cmake", "-DCMAKE_BUILD_TYPE=" + BUILD_TYPE, "..") != 0:
+            logger.error("CMake failed!")
+            exit(-1)
 
-    if execute("make", "-j" + str(threads)) != 0:
-        logger.error("Make failed!")
-        exit(-1)
+        if execute("make", "-j" + str(threads)) != 0:
+            logger.error("Make failed!")
+            exit(-1)
 
-    if not os.path.exists("lemondb"):
-        logger.error("Program not found!")
-        exit(-1)
+        if not os.path.exists("lemondb"):
+            logger.error("Program not found!")
+            exit(-1)
+    finally:
+        os.chdir(working_dir)
     logger.info("Build program for %s succeeded!", project_dir)
-    os.chdir(working_dir)
     return os.path.join(project_dir, build_dir, 'lemondb')
 
 
-# simply sort tables by lines because they are unordered
+def cached_build(project_dir, build_dir, threads, clean=False, key=None):
+    """
+        Reuse the program built from the same sources, compiler and flags,
+        clean ignores the cache and rebuilds from scratch.
+    """
+    key = key or hash_project(project_dir, build_dir, BUILD_TYPE)
+    program = cached_program(key)
+    if program and not clean:
+        logger.info('Use cached program %s for %s', program, project_dir)
+        return program
+    return store_program(key, build(project_dir, build_dir, threads, clean=clean))
+
+
+# sort the tables of an answer by lines because they are unordered, only to make them readable
 def sort_tables(table_dir):
     for filename in os.listdir(table_dir):
         if filename.endswith('.tbl'):
@@ -108,127 +139,128 @@ def sort_tables(table_dir):
             subprocess.run(['sort', filename, '-o', filename])
 
 
-def __run(q, program, base_query_file, query_files, temp_dir, threads, answer_dir):
+def kill_process_group(pid):
+    # lemondb is started in its own session, so its pid is also its process group id
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def __run(q, pid_value, program, query_dir, base_query_file, query_files, runtime_dir, threads, answer_dir,
+          answer_digests, cpus, types, watchdog, stdout_check, memory_limit):
     if answer_dir:
         answer_dir = os.path.abspath(answer_dir)
+    query_dir = os.path.abspath(query_dir)
 
     working_dir = os.getcwd()
-    runtime_dir = os.path.join(temp_dir, 'runtime')
 
     status = "AC"
     start = 0
     realtime = 0,
     exception = None
     p = None
-
-    def continue_pipe_query_file(query_file_stack, line_now, close_current=False):
-        if len(query_file_stack) == 0:
-            return line_now
-        query_file_now, fd, i = query_file_stack[-1]
-        # print("log ", query_file_now, fd, i, line_now)
-        if i == len(query_files[query_file_now]):
-            os.close(fd)
-            # print("close " + query_file_now)
-            query_file_stack.pop()
-            return continue_pipe_query_file(query_file_stack, line_now, close_current)
-        if close_current:
-            return line_now
-        data_lines, data = query_files[query_file_now][i]
-        query_file_stack[-1] = (query_file_now, fd, i + 1)
-        if data_lines > 0:
-            # print(data)
-            # print("write", data_lines, "lines")
-            os.write(fd, data)
-            line_now += data_lines
-            if i + 1 != len(query_files[query_file_now]):
-                return continue_pipe_query_file(query_file_stack, line_now)
-            return continue_pipe_query_file(query_file_stack, line_now, True)
-        else:
-            # print("open " + data)
-            fd = os.open(data, os.O_WRONLY)
-            query_file_stack.append((data, fd, 0))
-            return continue_pipe_query_file(query_file_stack, line_now)
-
-    def __continue_pipe_query_file(q, query_file_stack, line_now):
-        result = continue_pipe_query_file(query_file_stack, line_now)
-        q.put((result, query_file_stack))
-
-    def try_continue_pipe_query_file(thread, queue, query_file_stack, line, line_expect):
-        if thread:
-            thread.join(0)
-            if not thread.is_alive():
-                line_expect, query_file_stack = queue.get()
-                line_expect = min(line_max, line_expect)
-                thread = None
-        if thread is None:
-            if line.isdigit() and int(line) >= line_expect and (int(line) < line_max or line_max == 0):
-                # print('finish ', line_expect)
-                thread = threading.Thread(target=__continue_pipe_query_file, daemon=True,
-                                          args=(queue, query_file_stack, line_expect))
-                thread.start()
-        return thread, query_file_stack, line_expect
+    feeder = None
+    peak = None
+    usage = {}
+    trace = LatencyTrace(types) if types else None
+    # without a baseline the watchdog only records the progress curve
+    watchdog = ProgressWatchdog(**watchdog) if watchdog is not None else None
+    checker = StdoutChecker(**stdout_check) if stdout_check else None
+    memory = MemoryLimit(memory_limit, cgroup_name(os.getpid())) if memory_limit else None
+
+    def preexec():
+        # only lemondb runs on these cores, the harness keeps its own affinity
+        if cpus:
+            os.sched_setaffinity(0, cpus)
+        if memory:
+            memory.preexec()
 
     try:
-        # mutex = multiprocessing.Lock()
-
         shutil.rmtree(runtime_dir, ignore_errors=True)
         os.makedirs(runtime_dir, exist_ok=True)
         os.chdir(runtime_dir)
 
-        line_max = -1
-        for query_file, query_file_data in query_files.items():
+        for query_file in query_files.keys():
             os.mkfifo(query_file)
-            for data_lines, data in query_file_data:
-                line_max += data_lines
-
-        # out_fd = os.open('stdout', os.O_WRONLY | os.O_CREAT)
-
-        p = subprocess.Popen([program, "--listen=" + base_query_file, "--threads=" + str(threads)],
-                             stdout=subprocess.PIPE,
-                             stderr=subprocess.DEVNULL,
-                             universal_newlines=True
-                             )
-        start = time.time_ns()
-
-        base_query_fd = os.open(base_query_file, os.O_WRONLY)
-        query_file_stack = [(base_query_file, base_query_fd, 0)]
-
-        queue = Queue()
-        thread, query_file_stack, line_expect = try_continue_pipe_query_file(None, queue, query_file_stack, "0", 0)
-
-        stdout = []
-        while p.poll() is None:
-            line = p.stdout.readline()
-            stdout.append(line)
-            line = line.rstrip()
-            # print(line)
-            thread, query_file_stack, line_expect = try_continue_pipe_query_file(
-                thread, queue, query_file_stack, line, line_expect)
-
-        end = time.time_ns()
-
-        if p.returncode != 0:
+        feeder = QueryFeeder(query_dir, base_query_file, query_files)
+
+        with open('stdout', 'wb') as stdout_file:
+            if checker:
+                checker.attach(stdout_file)
+            p = subprocess.Popen([program, "--listen=" + base_query_file, "--threads=" + str(threads)],
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE,
+                                 start_new_session=True,
+                                 preexec_fn=preexec if cpus or memory else None
+                                 )
+            pid_value.value = p.pid
+            start = time.time_ns()
+            peak = PeakRss(p.pid)
+            if memory:
+                memory.start(p.pid)
+            if trace:
+                trace.start(start)
+            if watchdog:
+                watchdog.start()
+            stderr = pump(p, feeder, stdout_file, trace, watchdog, checker, memory, peak)
+            end, p.returncode, usage = wait_usage(p.pid, peak)
+            if trace:
+                usage['latency'] = trace.summary()
+            if watchdog and not watchdog.baseline_counters:
+                usage['progress'] = watchdog.curve()
+        kill_process_group(p.pid)
+        pid_value.value = 0
+
+        if p.returncode != 0 and memory and memory.exceeded(p.returncode, usage['max_rss']):
+            status = "MLE"
+            usage['max_rss'] = memory.peak
+        elif p.returncode != 0:
             status = "RTE"
+            logger.debug('lemondb exited with %d: %s', p.returncode, stderr.decode('utf-8', 'replace'))
 
-        with open('stdout', 'w') as f:
-            f.writelines(stdout)
-
-        # os.close(out_fd)
         for query_file in query_files.keys():
             os.remove(query_file)
 
         realtime = (end - start) / 1e9
         os.chdir(working_dir)
 
-        sort_tables(runtime_dir)
-        if answer_dir and status == "AC":
-            diff = subprocess.run(["diff", "-qbB", answer_dir, runtime_dir],
-                                  stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            if diff.returncode != 0:
+        if answer_digests and status == "AC":
+            checked = ()
+            if checker:
+                # the rest of stdout, then it does not need another pass
+                checker.finish()
+                checked = ('stdout',)
+            runtime_digests = digest_dir(runtime_dir, skip=checked)
+            runtime_digests.update({filename: answer_digests.get(filename) for filename in checked})
+            mismatches = compare_digests(answer_digests, runtime_digests)
+            if mismatches:
                 status = "WA"
+                for filename in mismatches:
+                    logger.debug(explain_mismatch(answer_dir, runtime_dir, filename, answer_digests, runtime_digests))
 
     except subprocess.TimeoutExpired:
         status = "TLE"
+    except HopelessRun as e:
+        # ended by the watchdog long before the timeout
+        status = "TLE"
+        realtime = e.elapsed
+        usage = {'projected_time': e.projected}
+    except MemoryLimitExceeded as e:
+        status = "MLE"
+        # reaped here to keep the resource usage until it was killed
+        kill_process_group(p.pid)
+        end, p.returncode, usage = wait_usage(p.pid, peak)
+        pid_value.value = 0
+        realtime = (end - start) / 1e9
+        usage['max_rss'] = max(usage['max_rss'], e.peak)
+    except StdoutMismatch as e:
+        # found while lemondb was running, or in the rest of stdout after it exited
+        status = "WA"
+        if p and p.returncode is None:
+            realtime = (time.time_ns() - start) / 1e9
+        usage['mismatch'] = e.to_dict()
+        logger.debug(e)
     except Exception as e:
         status = "RTE"
         exception = e
@@ -239,72 +271,141 @@ def __run(q, program, base_query_file, query_files, temp_dir, threads, answer_di
 
     try:
         if p and p.poll() is None:
-            p.kill()
+            kill_process_group(p.pid)
+            p.wait()
+            pid_value.value = 0
     except Exception as e:
         status = "RTE"
         exception = e
 
+    if feeder:
+        feeder.close()
+    if memory:
+        memory.close()
+
     if not isinstance(realtime, (int, float)):
         realtime = 0
-    q.put((status, realtime, exception))
-
-
-def run(program, base_query_file, query_files, temp_dir, threads, timeout=1000.0, answer_dir=None):
+    q.put((status, realtime, usage, exception))
+
+
+def run(program, query_dir, base_query_file, query_files, runtime_dir, threads, timeout=1000.0, answer_dir=None,
+        answer_digests=None, cpus=None, types=None, watchdog=None, stdout_check=None, memory_limit=None):
+    """
+        :param watchdog: arguments of the ProgressWatchdog, the run is ended early when its projected
+                         time exceeds the timeout, an empty dict only records the progress in usage
+        :param stdout_check: arguments of the StdoutChecker, the run is ended as WA at the first
+                             block of stdout different from the answer
+        :param memory_limit: bytes, a run using more ends as MLE
+    """
     q = multiprocessing.Queue()
+    pid_value = multiprocessing.Value('i', 0)
     p = multiprocessing.Process(target=__run,
-                                args=(q, program, base_query_file, query_files, temp_dir, threads, answer_dir,))
+                                args=(q, pid_value, program, query_dir, base_query_file, query_files, runtime_dir,
+                                      threads, answer_dir, answer_digests, cpus, types, watchdog, stdout_check,
+                                      memory_limit,))
     p.start()
-    p.join(timeout)
+    # the result is read before join, the run process can not exit until its result is out of the pipe
+    result = None
+    deadline = time.monotonic() + timeout
+    while result is None:
+        try:
+            result = q.get(timeout=max(0, min(RESULT_POLL_INTERVAL, deadline - time.monotonic())))
+        except queue.Empty:
+            if time.monotonic() >= deadline:
+                break
+            if not p.is_alive():
+                # the result may have been put right before the check
+                try:
+                    result = q.get(timeout=RESULT_POLL_INTERVAL)
+                except queue.Empty:
+                    pass
+                break
+    p.join(RESULT_POLL_INTERVAL)
     p.kill()
-    # kill lemondb with pkill
-    subprocess.run(['pkill', '-f', 'lemondb'])
-    if p.exitcode == 0:
-        status, realtime, exception = q.get()
+    # only kill the process group of this run, other runs may be in progress on the same host
+    if pid_value.value:
+        kill_process_group(pid_value.value)
+    if memory_limit:
+        remove_cgroup(cgroup_name(p.pid))
+    if result is not None:
+        status, realtime, usage, exception = result
         if exception:
             logger.exception(exception)
-        return status, realtime
+        return status, realtime, usage
     else:
-        return "TLE", timeout
-
-
-def read_query(query_dir, query):
-    query_files = {}
-
-    def add_query_file(filename):
-        if filename in query_files:
-            return
-        query_files[filename] = []
-        with open(os.path.join(query_dir, filename), 'r') as f:
-            lines = f.readlines()
-        start = 0
-        for i, line in enumerate(lines):
-            if line.startswith("LISTEN"):
-                query_files[filename].append((i + 1 - start, ''.join(lines[start:i + 1]).encode('UTF-8')))
-                result = re.findall(r"\(.+\)", line)
-                if result:
-                    listen_query_filename = result[0].strip('( )')
-                    add_query_file(listen_query_filename)
-                    query_files[filename].append((0, listen_query_filename))
-                start = i + 1
-        if start < len(lines):
-            query_files[filename].append((len(lines) - start, ''.join(lines[start:]).encode('utf-8')))
-
-    add_query_file(query)
-    return query_files
-
-
-def test(program, query, data_dir, temp_dir, threads, times=5, generate_answer=False, suggest_timeout=0):
+        return "TLE", timeout, {}
+
+
+def enough_runs(results, times, adaptive, elapsed):
+    """
+        Without adaptive options a query is run a fixed number of times, otherwise until
+        the confidence interval is narrow enough, or max_times or the time budget is reached.
+    """
+    if adaptive is None:
+        return len(results) >= times
+    if len(results) >= adaptive['max_times']:
+        return True
+    if adaptive['time_budget'] and elapsed >= adaptive['time_budget']:
+        return True
+    if len(results) < adaptive['min_times']:
+        return False
+    time_data = list(map(lambda x: x[1], results))
+    return relative_width(time_data, adaptive['confidence'], adaptive['center']) <= adaptive['ci_width']
+
+
+def prime_cache(paths):
+    """
+        Read files once so that they are in the page cache before the first timed run.
+    """
+    for path in paths:
+        with open(path, 'rb') as f:
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+            while f.read(CHUNK_SIZE):
+                pass
+
+
+def test(program, query, data_dir, temp_dir, threads, times=5, generate_answer=False, suggest_timeout=0,
+         slot=0, cpus=None, adaptive=None, warmup=0, prime=False, journal=None, trace=False, store=None,
+         watchdog_margin=WATCHDOG_MARGIN, memory_limit=None):
     working_dir = os.getcwd()
-    db_dir = os.path.join(temp_dir, 'db')
+    # every slot has its own runtime dir next to the shared db dir, so that "../db" still resolves
+    runtime_dir = os.path.join(temp_dir, 'runtime-%d' % slot)
     query_dir = os.path.join(data_dir, 'query')
     answer_dir = os.path.join(data_dir, 'answer', query)
+    answer_manifest_path = manifest_path(os.path.join(data_dir, 'answer'), query)
 
     base_query_file = query + '.query'
     query_files = read_query(query_dir, base_query_file)
+    types = query_types(query_dir, base_query_file, query_files) if trace else None
+    timeout = max(5.0, suggest_timeout * 1.2)
+    baseline = watchdog_margin and load_progress(answer_manifest_path)
+    watchdog = baseline and {'baseline': baseline, 'timeout': timeout, 'margin': watchdog_margin} or None
     # import pprint
     # pprint.pprint(query_files)
     results = []
 
+    if journal:
+        results = journal.finished(query, threads)
+        # runs of an interrupted session count towards the time budget of the adaptive mode
+        resumed_time = sum(map(lambda x: x[1], results))
+        if results and (results[-1][0] != "AC" or enough_runs(results, times, adaptive, resumed_time)):
+            logger.info('Skip %s.query, %d runs already finished', query, len(results))
+            update_pbar(suggest_timeout * times)
+            return results
+        if results:
+            logger.info('Resume %s.query after %d runs', query, len(results))
+            update_pbar(suggest_timeout * len(results))
+
+    if prime:
+        db_dir = os.path.join(temp_dir, 'db')
+        prime_cache([os.path.join(db_dir, filename) for filename in os.listdir(db_dir)] +
+                    [os.path.join(query_dir, filename) for filename in query_files.keys()])
+    for i in range(warmup):
+        status, realtime, usage = run(program, query_dir, base_query_file, query_files, runtime_dir, threads,
+                                      timeout=timeout, cpus=cpus, watchdog=watchdog, memory_limit=memory_limit)
+        logger.info('warm-up %d: %s %.3f s', i + 1, status, realtime)
+
     # exit(1)
     #
     # with open(query_file, 'rb') as f:
@@ -312,57 +413,82 @@ def test(program, query, data_dir, temp_dir, threads, times=5, generate_answer=F
 
     if generate_answer:
         logger.info('Generate answer for %s.query ...', query)
+        stdout_digests = set()
         for i in range(times):
-            status, realtime = run(program, base_query_file, query_files, temp_dir, threads)
+            status, realtime, usage = run(program, query_dir, base_query_file, query_files, runtime_dir, threads,
+                                          cpus=cpus, watchdog={})
             update_pbar(suggest_timeout)
-            results.append((status, realtime))
+            results.append((status, realtime, usage))
             logger.info('%2d: %s %.3f s', i + 1, status, realtime)
+            if status == "AC":
+                stdout_digests.add(digest_file(os.path.join(runtime_dir, 'stdout'))['digest'])
 
         if results[-1][0] == "AC":
             os.makedirs(answer_dir, exist_ok=True)
             shutil.rmtree(answer_dir, ignore_errors=True)
-            runtime_dir = os.path.join(temp_dir, 'runtime')
             shutil.copytree(runtime_dir, answer_dir)
+            sort_tables(answer_dir)
+            # stdout is checked while lemondb runs only if every answer run printed the same
+            stdout = {'deterministic': len(stdout_digests) == 1}
+            if stdout['deterministic']:
+                stdout['block_lines'] = STDOUT_BLOCK_LINES
+                stdout['blocks'] = digest_blocks(os.path.join(answer_dir, 'stdout'))
+                stdout['block_bytes'] = STDOUT_BLOCK_BYTES
+                stdout['raw_blocks'] = digest_raw_blocks(os.path.join(answer_dir, 'stdout'))
+            save_manifest(answer_manifest_path, query, digest_dir(answer_dir), results[-1][2].get('progress'), stdout)
         else:
             logger.error('Error: %s', results[-1][0])
 
     else:
         logger.info('Test %s.query ...', query)
-        if not os.path.exists(answer_dir):
-            logger.error('Error: answer not found!')
-            exit(-1)
-        for i in range(times):
-            status, realtime = run(program, base_query_file, query_files, temp_dir, threads,
-                                   timeout=max(5.0, suggest_timeout * 1.2), answer_dir=answer_dir)
-            results.append((status, realtime))
-            logger.info('%2d: %s %.3f s', i + 1, status, realtime)
+        answer_digests = load_manifest(answer_manifest_path)
+        if answer_digests is None:
+            if not os.path.exists(answer_dir):
+                logger.error('Error: answer not found!')
+                exit(-1)
+            # answers generated before manifests or with older digests, digest them once for all runs
+            answer_digests = digest_dir(answer_dir)
+        stdout_check = load_stdout_check(answer_manifest_path, os.path.abspath(os.path.join(answer_dir, 'stdout')))
+        test_start = time.time() - (journal and resumed_time or 0)
+        while not enough_runs(results, times, adaptive, time.time() - test_start):
+            status, realtime, usage = run(program, query_dir, base_query_file, query_files, runtime_dir, threads,
+                                          timeout=timeout, answer_dir=answer_dir, answer_digests=answer_digests,
+                                          cpus=cpus, types=types, watchdog=watchdog, stdout_check=stdout_check,
+                                          memory_limit=memory_limit)
+            results.append((status, realtime, usage))
+            if journal:
+                journal.append(query, threads, results[-1])
+            if store:
+                store.add_run(query, threads, len(results), results[-1])
+            if 'projected_time' in usage:
+                logger.info('%2d: %s %.3f s, projected %.3f s', len(results), status, realtime,
+                            usage['projected_time'])
+            elif status == "MLE":
+                logger.info('%2d: %s %.3f s, peak RSS %d MiB', len(results), status, realtime,
+                            usage['max_rss'] >> 20)
+            elif 'mismatch' in usage:
+                logger.info('%2d: %s %.3f s, stdout row %d after query %d', len(results), status, realtime,
+                            usage['mismatch']['row'], usage['mismatch']['query'])
+            else:
+                logger.info('%2d: %s %.3f s', len(results), status, realtime)
             if status == "AC":
                 update_pbar(suggest_timeout)
             else:
-                update_pbar(suggest_timeout * (times - i))
+                update_pbar(suggest_timeout * max(0, times - len(results) + 1))
                 break
+        if adaptive and results[-1][0] == "AC":
+            summary = summarize(list(map(lambda x: x[1], results)), adaptive['confidence'], adaptive['center'])
+            logger.info('%d runs, %s %.3f s, CI [%.3f, %.3f], stdev %.3f, outliers %s', summary['n'],
+                        adaptive['center'], summary[adaptive['center']], summary['ci_low'], summary['ci_high'],
+                        summary['stdev'], list(map(lambda x: x + 1, summary['outliers'])))
 
     os.chdir(working_dir)
     return results
 
 
-def get_platform():
-    cpu_info = cpuinfo.get_cpu_info()
-    memory_info = psutil.virtual_memory()
-    brand = ''
-    if 'brand_raw' in cpu_info:
-        brand = cpu_info['brand_raw']
-    elif 'brand' in cpu_info:
-        brand = cpu_info['brand']
-    return {
-        'platform': platform.platform(),
-        'cpu': brand,
-        'threads': cpu_info['count'],
-        'memory': humanize.naturalsize(memory_info.total, gnu=True)
-    }
-
-
 def init_tmpfs(data_dir, clean=False):
+    import memory_tempfile
+
     tempfile = memory_tempfile.MemoryTempfile(preferred_paths=['/run/user/{uid}'],
                                               remove_paths=['/dev/shm', '/run/shm'],
                                               additional_paths=['/var/run'], filesystem_types=['tmpfs'], fallback=True)
@@ -380,8 +506,13 @@ def init_tmpfs(data_dir, clean=False):
 
     temp_db_dir = os.path.join(temp_dir, 'db')
     db_dir = os.path.join(data_dir, 'db')
-    if not os.path.exists(temp_db_dir):
-        shutil.copytree(db_dir, temp_db_dir)
+    # also copy the tables added or changed since the last time, e.g. by generate_workload.py
+    os.makedirs(temp_db_dir, exist_ok=True)
+    for filename in os.listdir(db_dir):
+        path = os.path.join(db_dir, filename)
+        temp_path = os.path.join(temp_db_dir, filename)
+        if not os.path.exists(temp_path) or os.path.getmtime(temp_path) != os.path.getmtime(path):
+            shutil.copy2(path, temp_path)
 
     logger.info('DB initialized on %s', temp_dir)
     return os.path.abspath(temp_dir)
@@ -410,7 +541,7 @@ def update_pbar(value):
             pbar.update(value)
 
 
-def save_result(results, columns, time_path, status_path):
+def save_result(results, columns, time_path, status_path, usage_path):
     with open(time_path, 'w', newline='') as f:
         writer = csv.writer(f)
         writer.writerow(['query'] + list(map(lambda x: str(x + 1), range(columns))))
@@ -421,43 +552,380 @@ def save_result(results, columns, time_path, status_path):
         writer.writerow(['query'] + list(map(lambda x: str(x + 1), range(columns))))
         for i in range(len(TEST_QUERY)):
             writer.writerow([TEST_QUERY[i][0]] + list(map(lambda x: str(x[0]), results[i])))
+    with open(usage_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['query', 'iteration', 'status', 'time'] + USAGE_FIELDS)
+        for i in range(len(TEST_QUERY)):
+            for j, (status, realtime, usage) in enumerate(results[i]):
+                writer.writerow([TEST_QUERY[i][0], j + 1, status, realtime] +
+                                list(map(lambda x: str(usage.get(x, '')), USAGE_FIELDS)))
+
+
+def save_stats(results, stats_path, confidence=0.95, center='median'):
+    with open(stats_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['query', 'n', 'mean', 'median', 'stdev', 'variance', 'ci_low', 'ci_high',
+                         'relative_width', 'outliers'])
+        for i in range(len(TEST_QUERY)):
+            time_data = list(map(lambda x: x[1], filter(lambda x: x[0] == "AC", results[i])))
+            summary = summarize(time_data, confidence, center)
+            writer.writerow([TEST_QUERY[i][0], summary['n'], summary['mean'], summary['median'], summary['stdev'],
+                             summary['variance'], summary['ci_low'], summary['ci_high'], summary['relative_width'],
+                             ' '.join(map(lambda x: str(x + 1), summary['outliers']))])
+
+
+def save_latency(results, latency_path):
+    with open(latency_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(LATENCY_FIELDS)
+        for i in range(len(TEST_QUERY)):
+            latencies = {}
+            for status, realtime, usage in filter(lambda x: x[0] == "AC", results[i]):
+                for query_type, summary in usage.get('latency', {}).items():
+                    merge_summary(latencies.setdefault(query_type, new_summary()), summary)
+            writer.writerows(summarize_latency(TEST_QUERY[i][0], latencies))
+
+
+def load_base_time(answer_time_path):
+    base_time = {}
+    with open(answer_time_path) as f:
+        reader = csv.reader(f)
+        first_row = True
+        for row in reader:
+            if first_row:
+                first_row = False
+            else:
+                query = row[0]
+                time_data = list(map(lambda x: float(x), row[1:]))
+                base_time[query] = calculate_average_time(time_data)
+    return base_time
+
+
+def parse_cpu_list(ctx, param, value):
+    # cpu lists like taskset, e.g. 0-3,6
+    cpus = set()
+    try:
+        for part in filter(None, value.split(',')):
+            first, _, last = part.partition('-')
+            cpus.update(range(int(first), int(last or first) + 1))
+    except ValueError:
+        raise click.BadParameter('cores should be a list like 0-3,6')
+    return sorted(cpus) or None
+
+
+def allocate_cpu_sets(jobs, cpus=None):
+    cpus = sorted(cpus or os.sched_getaffinity(0))
+    if jobs > len(cpus):
+        logger.warning('%d jobs on %d cores, some jobs will share cores', jobs, len(cpus))
+        return [[cpus[i % len(cpus)]] for i in range(jobs)]
+    size = len(cpus) // jobs
+    return [cpus[i * size:(i + 1) * size] for i in range(jobs)]
+
+
+def calculate_scaling(sweep_results, threads_sweep):
+    """
+        :return: rows of (query, threads, status, average time, speedup, efficiency),
+                 speedup and efficiency are relative to the smallest thread count
+    """
+    scaling = []
+    for i, (query, unit_time) in enumerate(TEST_QUERY):
+        base_threads, base_average = None, None
+        for threads in threads_sweep:
+            result = sweep_results[threads][i]
+            status = "AC"
+            for x in result:
+                if x[0] != "AC":
+                    status = x[0]
+                    break
+            if status != "AC" or len(result) == 0:
+                scaling.append((query, threads, status, None, None, None))
+                continue
+            average = calculate_average_time(list(map(lambda x: x[1], result)))
+            if base_average is None:
+                base_threads, base_average = threads, average
+            speedup = base_average / average
+            scaling.append((query, threads, status, average, speedup, speedup * base_threads / threads))
+    return scaling
+
+
+def save_scaling(scaling, scaling_path):
+    with open(scaling_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['query', 'threads', 'status', 'average', 'speedup', 'efficiency'])
+        for row in scaling:
+            writer.writerow(map(lambda x: '' if x is None else str(x), row))
+
+
+def sweep(program, project_dir, data_dir, temp_dir, threads_sweep, times, base_time, slot=0, cpus=None,
+          adaptive=None, warmup=0, prime=False, journal=None, store=None, watchdog_margin=WATCHDOG_MARGIN,
+          memory_limit=None):
+    sweep_results = {}
+    for threads in threads_sweep:
+        logger.info('Sweep %s with %d threads', project_dir, threads)
+        sweep_results[threads] = []
+        for query, unit_time in TEST_QUERY:
+            result = test(program, query, data_dir, temp_dir, threads, times=times,
+                          suggest_timeout=base_time[query], slot=slot, cpus=cpus, adaptive=adaptive,
+                          warmup=warmup, prime=prime, journal=journal, store=store,
+                          watchdog_margin=watchdog_margin, memory_limit=memory_limit)
+            sweep_results[threads].append(result)
+
+    scaling = calculate_scaling(sweep_results, threads_sweep)
+    logger.debug(scaling)
+    save_scaling(scaling, os.path.join(project_dir, 'scaling.csv'))
+    return scaling
+
+
+def get_session(program, threads, times, base_time, threads_sweep, adaptive, trace, watchdog_margin, memory_limit):
+    return {
+        'program': hash_file(program),
+        'queries': TEST_QUERY,
+        'threads': threads_sweep or [threads],
+        'times': times,
+        'adaptive': adaptive,
+        'base_time': base_time,
+        'trace': trace,
+        'watchdog': watchdog_margin,
+        'memory_limit': memory_limit,
+    }
+
+
+def grade(program, project_dir, data_dir, temp_dir, threads, times, base_time, generate_answer=False,
+          slot=0, cpus=None, threads_sweep=None, adaptive=None, warmup=0, prime=False, resume=False, trace=False,
+          results_db=None, watchdog_margin=WATCHDOG_MARGIN, memory_limit=None):
+    journal = None
+    store = None
+    if not generate_answer:
+        session = get_session(program, threads, times, base_time, threads_sweep, adaptive, trace, watchdog_margin,
+                              memory_limit)
+        journal = Journal(os.path.join(project_dir, JOURNAL_NAME), session, resume=resume)
+        if results_db:
+            store = ResultStore(results_db)
+            store.open_session(project_dir, session, kind=threads_sweep and 'sweep' or 'grade', resume=resume)
+
+    if threads_sweep:
+        scaling = sweep(program, project_dir, data_dir, temp_dir, threads_sweep, times, base_time, slot=slot,
+                        cpus=cpus, adaptive=adaptive, warmup=warmup, prime=prime, journal=journal, store=store,
+                        watchdog_margin=watchdog_margin, memory_limit=memory_limit)
+        journal.close()
+        if store:
+            store.finish_session()
+            store.close()
+        return scaling
+
+    results = []
+    for query, unit_time in TEST_QUERY:
+        result = test(program, query, data_dir, temp_dir, threads,
+                      generate_answer=generate_answer, times=times,
+                      suggest_timeout=base_time[query], slot=slot, cpus=cpus, adaptive=adaptive,
+                      warmup=warmup, prime=prime, journal=journal, trace=trace, store=store,
+                      watchdog_margin=watchdog_margin, memory_limit=memory_limit)
+        results.append(result)
+    if journal:
+        journal.close()
+    if store:
+        store.finish_session()
+        store.close()
+
+    logger.debug(results)
+    # adaptive runs have a different number of columns for every query
+    columns = max([times] + list(map(len, results)))
+    if generate_answer:
+        save_result(results, columns, os.path.join(data_dir, 'answer', 'time.csv'),
+                    os.path.join(data_dir, 'answer', 'status.csv'), os.path.join(data_dir, 'answer', 'usage.csv'))
+    else:
+        save_result(results, columns, os.path.join(project_dir, 'time.csv'),
+                    os.path.join(project_dir, 'status.csv'), os.path.join(project_dir, 'usage.csv'))
+        if adaptive:
+            save_stats(results, os.path.join(project_dir, 'stats.csv'), adaptive['confidence'], adaptive['center'])
+        if trace:
+            save_latency(results, os.path.join(project_dir, 'latency.csv'))
+    return results
+
+
+# slot and cores owned by a scheduler worker process, assigned once in __init_worker
+worker_slot = None
+
+
+def __init_worker(slot_queue, cpu_sets):
+    global pbar, worker_slot
+    # the progress bar belongs to the scheduler process
+    pbar = None
+    slot = slot_queue.get()
+    worker_slot = (slot, cpu_sets[slot])
+
+
+def __grade_project(program, project_dir, data_dir, temp_dir, threads, times, base_time, threads_sweep, adaptive,
+                    warmup, prime, resume, trace, results_db, watchdog_margin, memory_limit):
+    slot, cpus = worker_slot
+    if threads == 0:
+        threads = len(cpus)
+    logger.info('Grading %s in slot %d on cores %s', project_dir, slot, cpus)
+    grade(program, project_dir, data_dir, temp_dir, threads, times, base_time, slot=slot, cpus=cpus,
+          threads_sweep=threads_sweep, adaptive=adaptive, warmup=warmup, prime=prime, resume=resume,
+          trace=trace, results_db=results_db, watchdog_margin=watchdog_margin, memory_limit=memory_limit)
+    return project_dir
+
+
+def __init_builder():
+    global pbar
+    pbar = None
+    # builds run next to the benchmarks of other projects, keep them out of the way
+    os.nice(10)
+
+
+def schedule(project_dirs, jobs, rebuild, data_dir, temp_dir, threads, times, base_time, threads_sweep=None,
+             adaptive=None, warmup=0, prime=False, cpus=None, build_jobs=1, resume=False, trace=False,
+             results_db=None, watchdog_margin=WATCHDOG_MARGIN, memory_limit=None):
+    """
+        Projects with a cached program start grading at once, the others are built in a
+        bounded pool first and start grading as soon as their build is finished.
+    """
+    cpu_sets = allocate_cpu_sets(jobs, cpus)
+    slot_queue = multiprocessing.Queue()
+    for slot in range(jobs):
+        slot_queue.put(slot)
+    build_threads = max(1, len(os.sched_getaffinity(0)) // build_jobs)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=__init_worker,
+                                                initargs=(slot_queue, cpu_sets)) as executor, \
+            concurrent.futures.ProcessPoolExecutor(max_workers=build_jobs, initializer=__init_builder) as builder:
+        def submit_grade(program, project_dir):
+            future = executor.submit(__grade_project, program, project_dir, data_dir, temp_dir, threads, times,
+                                     base_time, threads_sweep, adaptive, warmup, prime, resume, trace,
+                                     results_db, watchdog_margin, memory_limit)
+            futures[future] = ('Grading', project_dir)
+
+        futures = {}
+        for project_dir in project_dirs:
+            key = hash_project(project_dir, 'build', BUILD_TYPE)
+            program = cached_program(key)
+            if program and not rebuild:
+                logger.info('Use cached program %s for %s', program, project_dir)
+                submit_grade(program, project_dir)
+            else:
+                future = builder.submit(cached_build, project_dir, 'build', build_threads, rebuild, key)
+                futures[future] = ('Building', project_dir)
+
+        while futures:
+            done, not_done = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                action, project_dir = futures.pop(future)
+                try:
+                    result = future.result()
+                except BaseException as e:
+                    logger.error('%s %s failed: %s', action, project_dir, e)
+                    continue
+                logger.info('%s %s finished', action, project_dir)
+                if action == 'Building':
+                    submit_grade(result, project_dir)
+
+
+def parse_threads_sweep(ctx, param, value):
+    try:
+        return sorted(set(map(int, filter(None, value.split(','))))) or None
+    except ValueError:
+        raise click.BadParameter('thread counts should be separated by commas, e.g. 1,2,4,8')
+
+
+def parse_memory_limit(ctx, param, value):
+    try:
+        return value and parse_size(value) or None
+    except ValueError:
+        raise click.BadParameter('the limit should be a size such as 512M or 8G')
 
 
 @click.command()
-@click.option('-p', '--project-dir', help='LemonDB Directory.')
+@click.option('-p', '--project-dir', multiple=True, help='LemonDB Directory (can be given several times).')
 @click.option('-b', '--binary', default='', help='LemonDB Binary.')
 @click.option('--rebuild', is_flag=True, help='Rebuild tmpfs and project')
 @click.option('-d', '--data-dir', default='.', help='Data Directory (contains sample and db).')
+@click.option('-q', '--query', 'queries', multiple=True,
+              help='Query to test instead of the default ones, such as a generated workload.')
 @click.option('--generate-answer', is_flag=True, help='Generate answer.')
 @click.option('--times', default=5, type=int)
 @click.option('--threads', default=0, type=int)
-def main(project_dir, binary, rebuild, data_dir, generate_answer, times, threads):
+@click.option('-j', '--jobs', default=1, type=int, help='Number of projects graded at the same time.')
+@click.option('--build-jobs', default=0, type=int, help='Number of projects built at the same time, default to jobs.')
+@click.option('--threads-sweep', default='', callback=parse_threads_sweep,
+              help='Run every query with each thread count, e.g. 1,2,4,8, and save scaling.csv.')
+@click.option('--adaptive', is_flag=True, help='Repeat every query until its confidence interval is narrow enough.')
+@click.option('--ci-width', default=0.05, type=float, help='Target relative width of the confidence interval.')
+@click.option('--confidence', default=0.95, type=float, help='Confidence level of the interval.')
+@click.option('--center', default='median', type=click.Choice(['median', 'mean']))
+@click.option('--min-times', default=3, type=int, help='Minimum runs of every query in adaptive mode.')
+@click.option('--max-times', default=30, type=int, help='Maximum runs of every query in adaptive mode.')
+@click.option('--time-budget', default=0.0, type=float, help='Time budget of every query in adaptive mode, in seconds.')
+@click.option('--harness-cpus', default='', callback=parse_cpu_list, help='Pin the test harness to these cores.')
+@click.option('--lemondb-cpus', default='', callback=parse_cpu_list,
+              help='Run lemondb on these cores, by default all cores not used by the harness.')
+@click.option('--warmup', default=0, type=int, help='Discarded warm-up runs before the timed runs of every query.')
+@click.option('--prime-cache', 'prime', is_flag=True, help='Read the tables and queries into the page cache before every query.')
+@click.option('--resume', is_flag=True, help='Skip the runs already in the journal of the same program and settings.')
+@click.option('--trace-latency', 'trace', is_flag=True,
+              help='Record the latency of every query from the counters printed by lemondb.')
+@click.option('--results-db', default=RESULTS_DB,
+              help='SQLite database every run is added to, an empty string disables it.')
+@click.option('--watchdog-margin', default=WATCHDOG_MARGIN, type=float,
+              help='End a run as TLE when its time projected from the progress of the answer run exceeds the '
+                   'timeout by this factor, 0 disables the watchdog.')
+@click.option('--memory-limit', default='', callback=parse_memory_limit,
+              help='Memory of every run, such as 8G, a run using more is MLE.')
+def main(project_dir, binary, rebuild, data_dir, queries, generate_answer, times, threads, jobs, build_jobs, threads_sweep,
+         adaptive, ci_width, confidence, center, min_times, max_times, time_budget,
+         harness_cpus, lemondb_cpus, warmup, prime, resume, trace, results_db, watchdog_margin, memory_limit):
     global pbar, progress_max_value
+    import enlighten
+    import progressbar
+
     progressbar.streams.wrap_stderr()
 
     platform_info = get_platform()
-    if threads == 0:
-        threads = int(platform_info['threads'])
     logger.info(platform_info)
 
-    temp_dir = init_tmpfs(data_dir)
-    if project_dir:
-        project_dir = os.path.abspath(project_dir)
-        program = build(project_dir, 'build', threads, clean=rebuild)
-    else:
-        if binary:
-            program = binary
+    if harness_cpus:
+        if not lemondb_cpus:
+            lemondb_cpus = sorted(os.sched_getaffinity(0) - set(harness_cpus)) or None
+        # every process started by the harness inherits this affinity, except lemondb
+        os.sched_setaffinity(0, harness_cpus)
+        logger.info('Harness on cores %s, lemondb on cores %s', harness_cpus, lemondb_cpus)
+
+    if memory_limit:
+        if enable_memory_controller():
+            logger.info('Memory limit of %d MiB in a cgroup of every run', memory_limit >> 20)
         else:
-            program = os.path.join(os.path.dirname(__file__), 'bin', 'lemondb')
-        project_dir = os.path.abspath(os.path.dirname(program))
-    program = os.path.abspath(program)
+            logger.info('Memory limit of %d MiB with RLIMIT_DATA, no memory controller is delegated to the harness',
+                        memory_limit >> 20)
 
-    logger.info('Project Dir: %s', project_dir)
-    logger.info('LemonDB: %s', program)
+    if queries:
+        # the unit time is only used when the answer has no base time for the query
+        TEST_QUERY[:] = list(map(lambda x: (x, 1), queries))
 
+    project_dirs = list(map(os.path.abspath, project_dir))
+    if generate_answer and len(project_dirs) > 1:
+        logger.error('Error: answer can only be generated from one project!')
+        exit(-1)
+    if generate_answer and threads_sweep:
+        logger.error('Error: answer can not be generated in a threads sweep!')
+        exit(-1)
+    if trace and (generate_answer or threads_sweep):
+        logger.error('Error: latency can only be traced when grading!')
+        exit(-1)
+
+    if adaptive and not generate_answer:
+        adaptive = {
+            'ci_width': ci_width,
+            'confidence': confidence,
+            'center': center,
+            'min_times': min_times,
+            'max_times': max_times,
+            'time_budget': time_budget,
+        }
+    else:
+        adaptive = None
+
+    temp_dir = init_tmpfs(data_dir)
     answer_time_path = os.path.join(data_dir, 'answer', 'time.csv')
-    answer_status_path = os.path.join(data_dir, 'answer', 'status.csv')
-    results = []
     base_time = {}
     total_base_time = 0
 
@@ -465,23 +933,35 @@ def main(project_dir, binary, rebuild, data_dir, generate_answer, times, threads
         if not os.path.exists(answer_time_path):
             logger.error('Error: answer not found!')
             exit(-1)
-        with open(answer_time_path) as f:
-            reader = csv.reader(f)
-            first_row = True
-            for row in reader:
-                if first_row:
-                    first_row = False
-                else:
-                    query = row[0]
-                    time_data = list(map(lambda x: float(x), row[1:]))
-                    base_time[query] = calculate_average_time(time_data)
+        base_time = load_base_time(answer_time_path)
 
     for query, unit_time in TEST_QUERY:
         if query not in base_time:
             base_time[query] = unit_time
         total_base_time += base_time[query]
 
-    progress_max_value = total_base_time * times
+    jobs = max(1, min(jobs, len(project_dirs)))
+    if jobs > 1:
+        logger.info('Grading %d projects with %d jobs', len(project_dirs), jobs)
+        schedule(project_dirs, jobs, rebuild, data_dir, temp_dir, threads, times, base_time, threads_sweep, adaptive,
+                 warmup, prime, lemondb_cpus, build_jobs or jobs, resume, trace, results_db, watchdog_margin,
+                 memory_limit)
+        return
+
+    if threads == 0:
+        threads = lemondb_cpus and len(lemondb_cpus) or int(platform_info['threads'])
+    if project_dirs:
+        programs = [cached_build(project_dir, 'build', threads, clean=rebuild) for project_dir in project_dirs]
+    else:
+        if binary:
+            program = binary
+        else:
+            program = os.path.join(os.path.dirname(__file__), 'bin', 'lemondb')
+        programs = [program]
+        project_dirs = [os.path.abspath(os.path.dirname(program))]
+    programs = list(map(os.path.abspath, programs))
+
+    progress_max_value = total_base_time * times * len(programs) * len(threads_sweep or [threads])
     BAR_FMT = u'{desc}{desc_pad}{percentage:3.0f}%|{bar}| {count:{len_total}.1f}/{total:.1f} ' + \
               u'[{elapsed}<{eta}, {rate:.2f}{unit_pad}{unit}/s]'
 
@@ -492,23 +972,16 @@ def main(project_dir, binary, rebuild, data_dir, generate_answer, times, threads
     pbar = manager.counter(total=progress_max_value, desc='Progress', unit='ticks',
                            bar_format=BAR_FMT, counter_format=COUNTER_FMT)
 
-    for query, unit_time in TEST_QUERY:
-        result = test(program, query, data_dir, temp_dir, threads,
-                      generate_answer=generate_answer, times=times,
-                      suggest_timeout=base_time[query])
-        results.append(result)
+    for program, project_dir in zip(programs, project_dirs):
+        logger.info('Project Dir: %s', project_dir)
+        logger.info('LemonDB: %s', program)
+        grade(program, project_dir, data_dir, temp_dir, threads, times, base_time, generate_answer=generate_answer,
+              cpus=lemondb_cpus, threads_sweep=threads_sweep, adaptive=adaptive, warmup=warmup, prime=prime,
+              resume=resume, trace=trace, results_db=results_db, watchdog_margin=watchdog_margin,
+              memory_limit=memory_limit)
 
-        # break
     pbar.close()
 
-    logger.debug(results)
-    if generate_answer:
-        save_result(results, times, answer_time_path, answer_status_path)
-    else:
-        time_path = os.path.join(project_dir, 'time.csv')
-        status_path = os.path.join(project_dir, 'status.csv')
-        save_result(results, times, time_path, status_path)
-
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,83 @@
+"""
+LemonDB Resource Usage
+"""
+
+import os
+import time
+
+USAGE_FIELDS = [
+    'user_time',
+    'sys_time',
+    'max_rss',
+    'voluntary_switches',
+    'involuntary_switches',
+    'read_bytes',
+    'write_bytes',
+]
+# seconds between two samples of the peak RSS
+PEAK_INTERVAL = 0.02
+
+
+def read_peak_rss(pid):
+    """
+        :return: VmHWM of a process in bytes, 0 once it exited
+    """
+    try:
+        with open('/proc/%d/status' % pid, 'rb') as f:
+            for line in f:
+                if line.startswith(b'VmHWM:'):
+                    # in kB
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return 0
+
+
+class PeakRss:
+    """
+        Peak RSS of lemondb. ru_maxrss also counts the RSS of the harness which forked lemondb,
+        while VmHWM starts again at exec, but it is gone with the exited process, so it is
+        sampled while lemondb runs. A peak in the last PEAK_INTERVAL before exit may be missed.
+    """
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.peak = 0
+        self.last_sample = 0
+
+    def sample(self, force=False):
+        now = time.monotonic()
+        if force or now - self.last_sample >= PEAK_INTERVAL:
+            self.last_sample = now
+            self.peak = max(self.peak, read_peak_rss(self.pid))
+        return self.peak
+
+
+def wait_usage(pid, peak=None):
+    """
+        Wait for a child to exit and collect its resource usage. The child is only reaped
+        after its I/O counters are read, they disappear together with the zombie.
+        :param peak: PeakRss of the child, max_rss is 0 without it
+        :return: end time in ns, return code, usage
+    """
+    import psutil
+
+    os.waitid(os.P_PID, pid, os.WEXITED | os.WNOWAIT)
+    end = time.time_ns()
+    try:
+        io_counters = psutil.Process(pid).io_counters()
+        # read_bytes and write_bytes only count block devices, the tables live on a tmpfs
+        read_bytes, write_bytes = io_counters.read_chars, io_counters.write_chars
+    except (psutil.Error, AttributeError):
+        read_bytes, write_bytes = 0, 0
+    _, status, rusage = os.wait4(pid, 0)
+    usage = {
+        'user_time': rusage.ru_utime,
+        'sys_time': rusage.ru_stime,
+        'max_rss': peak and peak.peak or 0,
+        'voluntary_switches': rusage.ru_nvcsw,
+        'involuntary_switches': rusage.ru_nivcsw,
+        'read_bytes': read_bytes,
+        'write_bytes': write_bytes,
+    }
+    return end, os.waitstatus_to_exitcode(status), usage
@@ -0,0 +1,382 @@
+"""
+LemonDB Answer Verification
+"""
+
+import hashlib
+import itertools
+import json
+import os
+import re
+
+CHUNK_SIZE = 1 << 20
+WHITESPACE = (b' ', b'\t', b'\r', b'\f', b'\v')
+STDOUT_BLOCK_LINES = 4096
+STDOUT_BLOCK_BYTES = 1 << 16
+COUNTER_LINE = re.compile(rb'^\d+$')
+# manifests with digests of another version are ignored and the answer is digested again
+DIGEST_VERSION = 2
+LINE_DIGEST_SIZE = 16
+LINE_DIGEST_MODULUS = 1 << (8 * LINE_DIGEST_SIZE)
+
+
+def canonical_lines(lines):
+    """
+        Canonical form of lines as diff -bB sees them: white space at line end is dropped,
+        other runs of white space are equivalent and blank lines are ignored.
+    """
+    for line in lines:
+        words = line.split()
+        if words:
+            if line[:1] in WHITESPACE:
+                yield b' ' + b' '.join(words)
+            else:
+                yield b' '.join(words)
+
+
+def read_chunks(path):
+    # complete lines of a file, read in large chunks
+    tail = b''
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            lines = (tail + chunk).split(b'\n')
+            tail = lines.pop()
+            yield lines
+    if tail:
+        yield [tail]
+
+
+def line_digest(line):
+    return int.from_bytes(hashlib.blake2b(line, digest_size=LINE_DIGEST_SIZE).digest(), 'little')
+
+
+def digest_file(path, ordered=True):
+    """
+        Digest of the canonical lines of a file in one streaming pass. The lines of a table
+        dump are unordered, so their digest is the sum of the blake2b of every line modulo
+        2^128, which does not depend on the line order and needs no sorting.
+        :return: {'digest', 'rows', 'size'}
+    """
+    rows = 0
+    if ordered:
+        sha256 = hashlib.sha256()
+        for lines in read_chunks(path):
+            lines = list(canonical_lines(lines))
+            rows += len(lines)
+            for line in lines:
+                sha256.update(line)
+                sha256.update(b'\n')
+        digest = sha256.hexdigest()
+    else:
+        line_sum = 0
+        for lines in read_chunks(path):
+            lines = list(canonical_lines(lines))
+            rows += len(lines)
+            line_sum += sum(map(line_digest, lines))
+        digest = hashlib.sha256(b'%d:%x' % (rows, line_sum % LINE_DIGEST_MODULUS)).hexdigest()
+    return {
+        'digest': digest,
+        'rows': rows,
+        'size': os.path.getsize(path),
+    }
+
+
+def is_ordered(filename):
+    # only the table dumps are unordered, stdout is compared line by line
+    return not filename.endswith('.tbl')
+
+
+def digest_dir(directory, skip=()):
+    digests = {}
+    for filename in sorted(os.listdir(directory)):
+        path = os.path.join(directory, filename)
+        if os.path.isfile(path) and filename not in skip:
+            digests[filename] = digest_file(path, is_ordered(filename))
+    return digests
+
+
+def block_digest(lines):
+    sha256 = hashlib.sha256()
+    for line in lines:
+        sha256.update(line)
+        sha256.update(b'\n')
+    return sha256.hexdigest()[:16]
+
+
+def digest_blocks(path, block_lines=STDOUT_BLOCK_LINES):
+    """
+        :return: digests of every block_lines canonical lines of a file, the last block may be shorter
+    """
+    blocks = []
+    block = []
+    for lines in read_chunks(path):
+        for line in canonical_lines(lines):
+            block.append(line)
+            if len(block) == block_lines:
+                blocks.append(block_digest(block))
+                block = []
+    if block:
+        blocks.append(block_digest(block))
+    return blocks
+
+
+def digest_raw_blocks(path, block_bytes=STDOUT_BLOCK_BYTES):
+    """
+        :return: digests of every block_bytes bytes of a file as it is, the last block may be shorter
+    """
+    with open(path, 'rb') as f:
+        return list(map(lambda x: hashlib.sha256(x).hexdigest()[:16], iter(lambda: f.read(block_bytes), b'')))
+
+
+class StdoutMismatch(Exception):
+    def __init__(self, row, query, expected, actual):
+        if expected is None and actual is None:
+            message = 'stdout: rows from %d after query %d are different' % (row, query)
+        elif actual is None:
+            message = 'stdout: ends before row %d after query %d, expected "%s"' % (
+                row, query, expected.decode('utf-8', 'replace'))
+        elif expected is None:
+            message = 'stdout: row %d after query %d is "%s", expected the end' % (
+                row, query, actual.decode('utf-8', 'replace'))
+        else:
+            message = 'stdout: row %d after query %d is "%s", expected "%s"' % (
+                row, query, actual.decode('utf-8', 'replace'), expected.decode('utf-8', 'replace'))
+        super().__init__(message)
+        self.row = row
+        self.query = query
+        self.expected = expected
+        self.actual = actual
+
+    def to_dict(self):
+        return {
+            'row': self.row,
+            'query': self.query,
+            'expected': self.expected and self.expected.decode('utf-8', 'replace'),
+            'actual': self.actual and self.actual.decode('utf-8', 'replace'),
+        }
+
+
+class StdoutChecker:
+    """
+        Compare stdout with the block digests of the answer while lemondb is still running.
+        Only the raw bytes are hashed while they are the same as the answer, the canonical lines
+        are compared from the start once a raw block differs, so that white space still does
+        not matter. The answer stdout is only read to find the first different row once a
+        canonical block differs.
+    """
+
+    def __init__(self, blocks, block_lines, raw_blocks, block_bytes, answer_path=None):
+        self.blocks = blocks
+        self.block_lines = block_lines
+        self.raw_blocks = raw_blocks
+        self.block_bytes = block_bytes
+        self.answer_path = answer_path
+        # the file stdout is copied into, read again when the raw bytes differ
+        self.output = None
+        self.output_path = None
+        self.raw = True
+        self.raw_sha256 = hashlib.sha256()
+        self.raw_size = 0
+        self.raw_index = 0
+        self.tail = b''
+        self.block = []
+        self.index = 0
+        # canonical rows before the current block and the last query counter among them
+        self.row = 0
+        self.query = 0
+
+    def attach(self, output):
+        """
+            :param output: file stdout is written to before every chunk is fed
+        """
+        self.output = output
+        self.output_path = os.path.abspath(output.name)
+
+    def feed(self, chunk):
+        if self.raw:
+            self.__feed_raw(memoryview(chunk))
+        else:
+            self.__feed_lines(chunk)
+
+    def __feed_raw(self, chunk):
+        while chunk:
+            size = min(len(chunk), self.block_bytes - self.raw_size)
+            self.raw_sha256.update(chunk[:size])
+            self.raw_size += size
+            chunk = chunk[size:]
+            if self.raw_size == self.block_bytes:
+                if not self.__raw_block_matches():
+                    self.__feed_output()
+                    return
+                self.raw_index += 1
+                self.raw_sha256 = hashlib.sha256()
+                self.raw_size = 0
+
+    def __raw_block_matches(self):
+        return self.raw_index < len(self.raw_blocks) and \
+            self.raw_sha256.hexdigest()[:16] == self.raw_blocks[self.raw_index]
+
+    def __feed_output(self):
+        # all of stdout so far, including the rest of the last chunk, is compared line by line
+        self.raw = False
+        if not self.output.closed:
+            self.output.flush()
+        with open(self.output_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                self.__feed_lines(chunk)
+
+    def __feed_lines(self, chunk):
+        lines = (self.tail + chunk).split(b'\n')
+        self.tail = lines.pop()
+        for line in canonical_lines(lines):
+            self.block.append(line)
+            if len(self.block) == self.block_lines:
+                self.__check_block()
+
+    def finish(self):
+        """
+            Check the rest of stdout after lemondb exited, then all of stdout is verified.
+        """
+        if self.raw:
+            if self.raw_size == 0 and self.raw_index == len(self.raw_blocks):
+                return
+            if self.raw_size and self.raw_index == len(self.raw_blocks) - 1 and self.__raw_block_matches():
+                return
+            self.__feed_output()
+        if self.tail:
+            self.block += list(canonical_lines([self.tail]))
+            self.tail = b''
+        if self.block:
+            self.__check_block()
+        if self.index < len(self.blocks):
+            raise self.__mismatch()
+
+    def __check_block(self):
+        if self.index >= len(self.blocks) or block_digest(self.block) != self.blocks[self.index]:
+            raise self.__mismatch()
+        self.query = self.__last_query(self.block, self.query)
+        self.row += len(self.block)
+        self.index += 1
+        self.block = []
+
+    @staticmethod
+    def __last_query(lines, query):
+        for line in reversed(lines):
+            if COUNTER_LINE.match(line):
+                return int(line)
+        return query
+
+    def __mismatch(self):
+        if not self.answer_path or not os.path.exists(self.answer_path):
+            return StdoutMismatch(self.row + 1, self.query, None, None)
+        answer_lines = (line for lines in read_chunks(self.answer_path) for line in canonical_lines(lines))
+        expected_lines = list(itertools.islice(answer_lines, self.row, self.row + self.block_lines))
+        for i in range(max(len(expected_lines), len(self.block))):
+            expected = i < len(expected_lines) and expected_lines[i] or None
+            actual = i < len(self.block) and self.block[i] or None
+            if expected != actual:
+                return StdoutMismatch(self.row + i + 1, self.__last_query(self.block[:i], self.query), expected,
+                                      actual)
+        return StdoutMismatch(self.row + 1, self.query, None, None)
+
+
+def compare_digests(answer_digests, runtime_digests):
+    """
+        :return: filenames which are missing, unexpected or different
+    """
+    mismatches = []
+    for filename in sorted(set(answer_digests.keys()) | set(runtime_digests.keys())):
+        answer = answer_digests.get(filename)
+        result = runtime_digests.get(filename)
+        if answer is None or result is None or answer['digest'] != result['digest']:
+            mismatches.append(filename)
+    return mismatches
+
+
+def compare_dirs(answer_dir, runtime_dir):
+    return compare_digests(digest_dir(answer_dir), digest_dir(runtime_dir))
+
+
+def manifest_path(answer_root, query):
+    return os.path.join(answer_root, query + '.manifest.json')
+
+
+def save_manifest(path, query, digests, progress=None, stdout=None):
+    """
+        :param progress: [seconds, counter] of the answer run, the baseline of the progress watchdog
+        :param stdout: whether stdout is deterministic and its block digests, see load_stdout_check
+    """
+    manifest = {'query': query, 'version': DIGEST_VERSION, 'files': digests}
+    if progress:
+        manifest['progress'] = progress
+    if stdout:
+        manifest['stdout'] = stdout
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+
+def load_manifest(path):
+    """
+        :return: digests of the answer files, None without a manifest of the current digest version
+    """
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('version', 1) != DIGEST_VERSION:
+        return None
+    return manifest['files']
+
+
+def load_progress(path):
+    try:
+        with open(path) as f:
+            return json.load(f).get('progress')
+    except (OSError, ValueError):
+        return None
+
+
+def load_stdout_check(path, answer_path):
+    """
+        :param answer_path: answer stdout, for the raw digests of manifests written before them
+        :return: arguments of the StdoutChecker, None unless stdout is deterministic and has raw digests
+    """
+    try:
+        with open(path) as f:
+            stdout = json.load(f).get('stdout')
+    except (OSError, ValueError):
+        return None
+    if not stdout or not stdout.get('deterministic'):
+        return None
+    if 'raw_blocks' not in stdout:
+        if not os.path.exists(answer_path):
+            return None
+        stdout['raw_blocks'] = digest_raw_blocks(answer_path)
+        stdout['block_bytes'] = STDOUT_BLOCK_BYTES
+    return {'blocks': stdout['blocks'], 'block_lines': stdout['block_lines'], 'raw_blocks': stdout['raw_blocks'],
+            'block_bytes': stdout['block_bytes'], 'answer_path': answer_path}
+
+
+def explain_mismatch(answer_dir, runtime_dir, filename, answer_digests, runtime_digests):
+    """
+        Explain why a file does not match its answer, the answer file is only opened here.
+    """
+    answer = answer_digests.get(filename)
+    result = runtime_digests.get(filename)
+    if answer is None:
+        return '%s: unexpected file' % filename
+    if result is None:
+        return '%s: file not found' % filename
+    if answer['rows'] != result['rows']:
+        return '%s: %d rows, expected %d' % (filename, result['rows'], answer['rows'])
+    answer_path = os.path.join(answer_dir, filename)
+    if not is_ordered(filename) or not os.path.exists(answer_path):
+        return '%s: different rows' % filename
+    expected_lines = (line for lines in read_chunks(answer_path) for line in canonical_lines(lines))
+    actual_lines = (line for lines in read_chunks(os.path.join(runtime_dir, filename))
+                    for line in canonical_lines(lines))
+    for i, (expected, actual) in enumerate(zip(expected_lines, actual_lines)):
+        if expected != actual:
+            return '%s: row %d is "%s", expected "%s"' % (filename, i + 1, actual.decode('utf-8', 'replace'),
+                                                         expected.decode('utf-8', 'replace'))
+    return '%s: different rows' % filename
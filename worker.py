@@ -0,0 +1,138 @@
+"""
+LemonDB Grading Worker
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+import urllib.request
+
+import click
+from logzero import logger
+
+import test
+from build_cache import CACHE_DIR
+from coordinator import PORT, RETRY_INTERVAL
+from memory_limit import enable_memory_controller
+from probe import get_platform, hardware_key
+from query_index import hash_file
+
+HEARTBEAT_INTERVAL = 10.0
+# the worker exits when the coordinator is unreachable for this many attempts in a row
+MAX_RETRIES = 12
+
+
+def post(url, path, data):
+    request = urllib.request.Request(url.rstrip('/') + path, data=json.dumps(data).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=60) as response:
+        return json.load(response)
+
+
+class Worker:
+    """
+        Lease jobs from the coordinator and run them with test(), one run of a query each.
+    """
+
+    def __init__(self, url, name, machine, data_dir, threads, slot, memory_limit):
+        self.url = url
+        self.name = name
+        self.machine = machine
+        # builds and test() change the working dir while they run
+        self.data_dir = os.path.abspath(data_dir)
+        self.threads = threads
+        self.slot = slot
+        self.memory_limit = memory_limit
+        self.temp_dir = test.init_tmpfs(self.data_dir)
+        # project -> (program, program hash), program is None if the build failed
+        self.programs = {}
+        self.stopped = threading.Event()
+
+    def __post(self, path, data):
+        for i in range(MAX_RETRIES):
+            try:
+                return post(self.url, path, data)
+            except OSError as e:
+                logger.warning('Coordinator %s unreachable: %s', self.url, e)
+                time.sleep(RETRY_INTERVAL)
+        logger.error('Error: coordinator %s lost!', self.url)
+        exit(-1)
+
+    def __heartbeat(self):
+        while not self.stopped.wait(HEARTBEAT_INTERVAL):
+            try:
+                post(self.url, '/heartbeat', {'worker': self.name})
+            except OSError as e:
+                logger.warning('Heartbeat failed: %s', e)
+
+    def build(self, project_dir):
+        if project_dir not in self.programs:
+            # workers on the same host share the project dir, only one of them builds it
+            lock_path = os.path.join(CACHE_DIR, 'lock-' + hashlib.sha256(project_dir.encode('utf-8')).hexdigest()[:16])
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            with open(lock_path, 'w') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    program = test.cached_build(project_dir, 'build', self.threads)
+                    self.programs[project_dir] = (program, hash_file(program))
+                except SystemExit:
+                    self.programs[project_dir] = (None, None)
+        return self.programs[project_dir]
+
+    def run(self, job):
+        program, program_hash = self.build(job['project'])
+        if program is None:
+            return ('CE', 0, {}), None
+        results = test.test(program, job['query'], self.data_dir, self.temp_dir, self.threads, times=1,
+                            suggest_timeout=job['timeout'], slot=self.slot, memory_limit=self.memory_limit)
+        return results[-1], program_hash
+
+    def serve(self):
+        logger.info('Worker %s of machine class %s', self.name, self.machine)
+        heartbeat = threading.Thread(target=self.__heartbeat, daemon=True)
+        heartbeat.start()
+        try:
+            while True:
+                reply = self.__post('/lease', {'worker': self.name, 'machine': self.machine})
+                if reply.get('done'):
+                    break
+                if 'job' not in reply:
+                    time.sleep(reply.get('wait', RETRY_INTERVAL))
+                    continue
+                job = reply['job']
+                logger.info('Run %s', job['id'])
+                result, program_hash = self.run(job)
+                self.__post('/result', {'worker': self.name, 'job': job['id'], 'result': result,
+                                        'program': program_hash, 'threads': self.threads})
+        finally:
+            self.stopped.set()
+            shutil.rmtree(os.path.join(self.temp_dir, 'runtime-%d' % self.slot), ignore_errors=True)
+        logger.info('All jobs finished')
+
+
+@click.command()
+@click.option('-c', '--coordinator', 'url', default='http://localhost:%d' % PORT, help='URL of the coordinator.')
+@click.option('-d', '--data-dir', default='.', help='Data Directory (contains sample and db).')
+@click.option('--threads', default=0, type=int, help='Threads of lemondb, default to the number of cores.')
+@click.option('--name', help='Name of the worker, default to the host name and pid.')
+@click.option('--machine-class', help='Workers of a class have the same hardware, default to a hash of it.')
+@click.option('--memory-limit', default='', callback=test.parse_memory_limit,
+              help='Memory of every run, such as 8G, a run using more is MLE.')
+def main(url, data_dir, threads, name, machine_class, memory_limit):
+    if threads == 0:
+        threads = int(get_platform()['threads'])
+    if memory_limit and not enable_memory_controller():
+        logger.info('Memory limit with RLIMIT_DATA, no memory controller is delegated to the worker')
+    # the pid is also the slot, so that workers on the same host have their own runtime dirs
+    worker = Worker(url, name or '%s-%d' % (socket.gethostname(), os.getpid()),
+                    machine_class or hardware_key()[:12], data_dir, threads, os.getpid(), memory_limit)
+    worker.serve()
+
+
+if __name__ == '__main__':
+    main()